@@ -22,7 +22,7 @@ from shop.admin.product import CMSPageAsCategoryMixin, UnitPriceMixin, ProductIm
 from polymorphic.admin import (PolymorphicParentModelAdmin, PolymorphicChildModelAdmin,
                                PolymorphicChildModelFilter)
 from alby.models import Product, Commodity, SofaModel, SofaVariant
-from alby.models import CommodityInventory, Lamel, Discount, LamelInventory, Fabric, VariantImage
+from alby.models import CommodityInventory, Lamel, Discount, LamelInventory, Fabric, VariantImage, ShippingRate
 from nested_inline.admin import NestedStackedInline, NestedModelAdmin, NestedTabularInline
 from adminsortable2.admin import SortableInlineAdminMixin
 
@@ -190,6 +190,14 @@ class SofaModelAdmin(InvalidateProductCacheMixin, SortableAdminMixin, Translatab
 
 admin.site.register(Discount)
 
+
+@admin.register(ShippingRate)
+class ShippingRateAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'modifier', 'min_weight', 'amount']
+    list_display_links = ['__str__']
+    list_editable = ['min_weight', 'amount']
+    list_filter = ['modifier']
+
 @admin.register(Product)
 class ProductAdmin(PolymorphicSortableAdminMixin, PolymorphicParentModelAdmin):
     base_model = Product
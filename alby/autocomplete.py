@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Prefix index answering the autocomplete lookups of the catalog without the search engine.
+
+The worker writes one index file per language using ``manage.py build_autocomplete_index``.
+Each web process memory-maps that file, so all processes share the same pages, and looks up
+prefixes by bisecting the sorted array of terms.
+"""
+from __future__ import unicode_literals
+
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.utils.html import strip_tags
+from django.utils.translation import get_language
+
+logger = logging.getLogger('alby')
+
+
+def get_terms(text):
+    return re.findall(r'\w+', strip_tags(text or '').lower(), re.UNICODE)
+
+
+class MappedTerms(object):
+    """
+    Sorted entries ``(offset, length, product id)`` of a memory-mapped index file, followed by
+    the UTF-8 encoded terms the entries refer to.
+    """
+    def __init__(self, mapped, count, header_size, entry):
+        self.mapped = mapped
+        self.count = count
+        self.entry = entry
+        self.entries_start = header_size
+        self.terms_start = header_size + count * entry.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        """
+        Return the term of the entry at ``position``, which makes the entries bisectable.
+        """
+        return self.get_entry(position)[0]
+
+    def get_entry(self, position):
+        offset, length, pk = self.entry.unpack_from(self.mapped, self.entries_start + position * self.entry.size)
+        start = self.terms_start + offset
+        return self.mapped[start:start + length], pk
+
+    def lookup(self, prefix, max_matches):
+        """
+        Return the ids of all products having a term starting with ``prefix``.
+        """
+        prefix = prefix.encode('utf-8')
+        matches = set()
+        position = bisect_left(self, prefix)
+        while position < self.count and len(matches) < max_matches:
+            term, pk = self.get_entry(position)
+            if not term.startswith(prefix):
+                break
+            matches.add(pk)
+            position += 1
+        return matches
+
+
+class PrefixIndex(object):
+    """
+    Memory-mapped file containing a header, the sorted entries ``(offset, length, product id)``
+    and the UTF-8 encoded terms the entries refer to.
+    """
+    MAGIC = b'ALBYPX01'
+    HEADER = struct.Struct('<8sI')
+    ENTRY = struct.Struct('<IHI')
+    check_interval = 5
+    max_matches = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # replaced as a whole when the file changes, so that readers never mix two files
+        self._terms = None
+        self._stat = None
+        self._checked_at = 0
+
+    @classmethod
+    def write(cls, path, entries):
+        """
+        Write the index for the given ``(term, product id)`` pairs. The file is replaced
+        atomically, processes still mapping the previous file continue to use it until they
+        notice the new one.
+        """
+        entries = sorted(set((term.encode('utf-8')[:0xffff], pk) for term, pk in entries))
+        terms, offsets, offset = {}, [], 0
+        for term, pk in entries:
+            if term not in terms:
+                terms[term] = offset
+                offset += len(term)
+            offsets.append((terms[term], len(term), pk))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        temp_path = '{}.{}'.format(path, os.getpid())
+        with open(temp_path, 'wb') as fh:
+            fh.write(cls.HEADER.pack(cls.MAGIC, len(offsets)))
+            for entry in offsets:
+                fh.write(cls.ENTRY.pack(*entry))
+            fh.write(b''.join(sorted(terms, key=terms.get)))
+        os.replace(temp_path, path)
+        return len(offsets)
+
+    def refresh(self):
+        """
+        Map the index file, or map it again if it has been replaced since. A missing or invalid
+        file leaves the index unavailable.
+        """
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            self._checked_at = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                self._terms, self._stat = None, None
+                return
+            if self._stat and (stat.st_ino, stat.st_mtime) == (self._stat.st_ino, self._stat.st_mtime):
+                return
+            try:
+                self._terms = self.map_file()
+            except (OSError, ValueError, struct.error) as exc:
+                logger.warning("Autocomplete index {} is unusable: {}".format(self.path, exc))
+                self._terms = None
+            self._stat = stat
+
+    def map_file(self):
+        with open(self.path, 'rb') as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = self.HEADER.unpack_from(mapped, 0)
+        if magic != self.MAGIC:
+            raise ValueError("{} is not an autocomplete index".format(self.path))
+        if len(mapped) < self.HEADER.size + count * self.ENTRY.size:
+            raise ValueError("{} is truncated".format(self.path))
+        return MappedTerms(mapped, count, self.HEADER.size, self.ENTRY)
+
+    def is_available(self):
+        self.refresh()
+        return self._terms is not None
+
+    def search(self, query):
+        """
+        Return the ids of the products matching all words of ``query``, each as a prefix.
+        """
+        self.refresh()
+        terms = self._terms
+        if terms is None:
+            return set()
+        matches = None
+        for word in get_terms(query):
+            found = terms.lookup(word, self.max_matches)
+            matches = found if matches is None else matches & found
+            if not matches:
+                break
+        return matches or set()
+
+
+_prefix_indexes = {}
+
+
+def get_prefix_index(language=None):
+    language = language or get_language()
+    if language not in _prefix_indexes:
+        directory = getattr(settings, 'ALBY_AUTOCOMPLETE_DIR', os.path.join(settings.WORK_DIR, 'search'))
+        _prefix_indexes[language] = PrefixIndex(os.path.join(directory, 'autocomplete-{}.idx'.format(language)))
+    return _prefix_indexes[language]
+
+
+class AutocompleteFilterBackend(object):
+    """
+    Restrict the product list to the products whose names, captions or product codes start with
+    the words of the query parameter ``q``.
+    """
+    def filter_queryset(self, request, queryset, view):
+        query = request.GET.get('q')
+        if not query:
+            return queryset
+        return queryset.filter(pk__in=get_prefix_index().search(query))
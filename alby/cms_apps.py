@@ -8,18 +8,20 @@ from cms.cms_menus import SoftRootCutter
 from menus.menu_pool import menu_pool
 from shop.cms_apphooks import CatalogListCMSApp, CatalogSearchCMSApp, OrderApp, PasswordResetApp
 from alby.serializers.product import CustomizedProductSerializer
-from alby.views import UpdateDataView
+from alby.views import FabricDetailsView, PriceCurveView, VariantMatrixView
 
 class CatalogListApp(CatalogListCMSApp):
     def get_urls(self, page=None, language=None, **kwargs):
-        from shop.search.views import CMSPageCatalogWrapper
-        from shop.views.catalog import AddToCartView, ProductRetrieveView
-        from alby.serializers import CatalogSearchSerializer, RebateAddToCartSerializer, AddSofaToCartSerializer, UpdateDataSerialiser
+        from alby.views.catalog import AutocompleteCatalogWrapper, ProductRetrieveView, cache_catalog_response
+        from shop.views.catalog import AddToCartView
+        from alby.filters import FacetFilterSet
+        from alby.serializers import CatalogSearchSerializer, RebateAddToCartSerializer, AddSofaToCartSerializer
 
         return [
-            url(r'^$', CMSPageCatalogWrapper.as_view(
+            url(r'^$', cache_catalog_response(AutocompleteCatalogWrapper.as_view(
                 search_serializer_class=CatalogSearchSerializer,
-            )),
+                filter_class=FacetFilterSet,
+            ))),
             url(r'^(?P<slug>[\w-]+)/add-to-cart', AddToCartView.as_view()),
             url(r'^(?P<slug>[\w-]+)/get-rebate', AddToCartView.as_view(
                 serializer_class=RebateAddToCartSerializer,
@@ -27,9 +29,9 @@ class CatalogListApp(CatalogListCMSApp):
             url(r'^(?P<slug>[\w-]+)/add-sofa-to-cart', AddToCartView.as_view(
                 serializer_class=AddSofaToCartSerializer,
             )),
-            url(r'^(?P<slug>[\w-]+)/update-small-data', UpdateDataView.as_view(
-                serializer_class=UpdateDataSerialiser,
-            )),
+            url(r'^(?P<slug>[\w-]+)/fabric-details', FabricDetailsView.as_view()),
+            url(r'^(?P<slug>[\w-]+)/variant-matrix', VariantMatrixView.as_view()),
+            url(r'^(?P<slug>[\w-]+)/price-curve', PriceCurveView.as_view()),
             url(r'^/divany/(?P<slug>[\w-]+)', ProductRetrieveView.as_view(
                 use_modal_dialog=False,
                 serializer_class=CustomizedProductSerializer,
@@ -47,11 +49,12 @@ class CatalogSearchApp(CatalogSearchCMSApp):
     def get_urls(self, page=None, language=None, **kwargs):
         from shop.search.views import SearchView
         from alby.serializers import ProductSearchSerializer
+        from alby.views.catalog import cache_catalog_response
 
         return [
-            url(r'^', SearchView.as_view(
+            url(r'^', cache_catalog_response(SearchView.as_view(
                 serializer_class=ProductSearchSerializer,
-            )),
+            ))),
         ]
 
 
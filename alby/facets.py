@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Facet index used to filter the catalog by product attributes.
+
+For each attribute value the index holds the set of matching product ids as a bitset, a Python
+integer whose bit ``n`` is set for the product with primary key ``n``. Filtering and counting
+then are intersections of integers instead of database queries. The index is rebuilt by each
+process, whenever the catalog version has changed.
+"""
+from __future__ import unicode_literals
+
+import threading
+from collections import OrderedDict
+from decimal import Decimal
+from django.conf import settings
+from django.utils.text import format_lazy
+from django.utils.translation import ugettext_lazy as _
+from alby.models import Commodity, Fabric, Lamel, SofaModel
+from alby.system.cache import get_catalog_version
+
+
+def to_bits(pks):
+    bits = 0
+    for pk in pks:
+        bits |= 1 << pk
+    return bits
+
+
+def iter_ids(bits):
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+def count_bits(bits):
+    return bin(bits).count('1')
+
+
+def get_price_bands():
+    """
+    Return the price bands as list of ``(value, label, lower, upper)`` taken from the limits in
+    ``settings.ALBY_PRICE_BANDS``.
+    """
+    limits = [Decimal(limit) for limit in getattr(settings, 'ALBY_PRICE_BANDS', (0, 50, 100, 250, 500, 1000))]
+    bands = []
+    for lower, upper in zip(limits, limits[1:] + [None]):
+        if upper is None:
+            bands.append(('{}-'.format(lower), format_lazy(_("from {}"), lower), lower, None))
+        else:
+            bands.append(('{}-{}'.format(lower, upper), '{} – {}'.format(lower, upper), lower, upper))
+    return bands
+
+
+class FacetIndex(object):
+    """
+    Bitsets of product ids, per attribute and value.
+    """
+    def __init__(self, version, facets):
+        self.version = version
+        self.facets = facets
+
+    @classmethod
+    def build(cls, version):
+        facets = OrderedDict()
+        facets['lamel_width'] = cls.group(Lamel.objects.filter(active=True).values_list('pk', 'lamel_width'))
+        facets['fabric_type'] = cls.group(Fabric.objects.filter(active=True).values_list('pk', 'fabric_type'))
+        facets['sofa_type'] = cls.group(SofaModel.objects.filter(active=True).values_list('pk', 'sofa_type'))
+
+        prices = []
+        for model in (Lamel, Commodity, Fabric):
+            prices.extend(model.objects.filter(active=True).values_list('pk', 'unit_price'))
+        prices.extend(SofaModel.objects.filter(active=True).values_list('pk', 'price_from'))
+        # compare plain decimals, since Money refuses to be compared with other currencies
+        prices = [(pk, price.as_decimal()) for pk, price in prices if price is not None]
+        facets['price'] = OrderedDict()
+        for value, label, lower, upper in get_price_bands():
+            facets['price'][value] = to_bits(pk for pk, price in prices
+                                             if price >= lower and (upper is None or price < upper))
+        return cls(version, facets)
+
+    @staticmethod
+    def group(rows):
+        groups = OrderedDict()
+        for pk, value in rows:
+            groups[value] = groups.get(value, 0) | 1 << pk
+        return groups
+
+    def get_bits(self, selection, exclude=None):
+        """
+        Return the bitset of products matching any of the selected values of each attribute,
+        given as ``{attribute: [value, ...]}``, or ``None`` if nothing is selected.
+        """
+        bits = None
+        for attribute, values in selection.items():
+            if attribute == exclude or attribute not in self.facets or not values:
+                continue
+            matching = 0
+            for value in values:
+                matching |= self.facets[attribute].get(value, 0)
+            bits = matching if bits is None else bits & matching
+        return bits
+
+    def get_counts(self, base, selection):
+        """
+        Return the number of products per attribute and value among the products in ``base``.
+        Each attribute is counted as if its own selection was cleared, so that its alternative
+        values keep their counts.
+        """
+        counts = OrderedDict()
+        for attribute, groups in self.facets.items():
+            others = self.get_bits(selection, exclude=attribute)
+            scope = base if others is None else base & others
+            counts[attribute] = OrderedDict((value, count_bits(bits & scope)) for value, bits in groups.items())
+        return counts
+
+
+_facet_index = None
+_lock = threading.Lock()
+
+
+def get_facet_index():
+    """
+    Return the facet index of this process, rebuilt if a product has been changed since.
+    """
+    global _facet_index
+
+    version = get_catalog_version()
+    if _facet_index is None or _facet_index.version != version:
+        with _lock:
+            if _facet_index is None or _facet_index.version != version:
+                _facet_index = FacetIndex.build(version)
+    return _facet_index
@@ -8,12 +8,70 @@ from django_filters import FilterSet
 from djng.forms import NgModelFormMixin
 from djng.styling.bootstrap3.forms import Bootstrap3Form
 
-from shop.filters import ModelChoiceFilter
+from shop.filters import ChoiceFilter, ModelChoiceFilter
 
-from alby.models import Product
+from alby.facets import get_facet_index, get_price_bands, iter_ids, to_bits
+from alby.models import Fabric, Lamel, Product, SofaModel
 
 
 class FilterForm(NgModelFormMixin, Bootstrap3Form):
     scope_prefix = 'filters'
 
 
+
+class FacetFilterSet(FilterSet):
+    """
+    Filter the catalog by lamel width, fabric type, sofa type and price band. Instead of adding
+    conditions for each attribute, the matching products are looked up in the facet index.
+    """
+    lamel_width = ChoiceFilter(
+        label=_("Width"),
+        choices=[('', _("Any width"))] + list(Lamel.LAM_WIDTH),
+        widget=Select(attrs={'ng-change': 'filterChanged()'}),
+    )
+    fabric_type = ChoiceFilter(
+        label=_("Fabric type"),
+        choices=[('', _("Any fabric"))] + list(Fabric.FABRIC_TYPE),
+        widget=Select(attrs={'ng-change': 'filterChanged()'}),
+    )
+    sofa_type = ChoiceFilter(
+        label=_("Sofa Type"),
+        choices=[('', _("Any sofa type"))] + list(SofaModel._meta.get_field('sofa_type').choices),
+        widget=Select(attrs={'ng-change': 'filterChanged()'}),
+    )
+    price = ChoiceFilter(
+        label=_("Price"),
+        choices=[('', _("Any price"))] + [(value, label) for value, label, lower, upper in get_price_bands()],
+        widget=Select(attrs={'ng-change': 'filterChanged()'}),
+    )
+
+    class Meta:
+        model = Product
+        form = FilterForm
+        fields = []
+
+    def get_selection(self):
+        return dict((name, [value]) for name, value in self.form.cleaned_data.items() if value)
+
+    def filter_queryset(self, queryset):
+        bits = get_facet_index().get_bits(self.get_selection())
+        if bits is None:
+            return queryset
+        return queryset.filter(pk__in=list(iter_ids(bits)))
+
+    @classmethod
+    def get_render_context(cls, request, queryset):
+        """
+        Prepare the filter set, labelling each choice with the number of products on this page
+        it would leave.
+        """
+        filter_set = cls(data=request.GET)
+        selection = filter_set.get_selection() if filter_set.is_valid() else {}
+        facet_index = get_facet_index()
+        counts = facet_index.get_counts(to_bits(queryset.values_list('pk', flat=True)), selection)
+        for name, values in counts.items():
+            field = filter_set.form.fields[name]
+            field.choices = [(value, '{} ({})'.format(label, values.get(value, 0)) if value else label)
+                             for value, label in field.choices
+                             if not value or values.get(value) or selection.get(name) == [value]]
+        return dict(filter_set=filter_set)
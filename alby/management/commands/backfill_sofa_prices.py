@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import models
+from alby.models import SofaModel, SofaVariant
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored 'price from' of all sofa models from their variants."
+
+    def handle(self, *args, **options):
+        lowest = SofaVariant.objects.filter(product_model=models.OuterRef('pk')).order_by().values(
+            'product_model').annotate(lowest=models.Min('unit_price')).values('lowest')
+        updated = SofaModel.objects.update(price_from=models.Subquery(lowest))
+        self.stdout.write("Updated the price of {} sofa models.".format(updated))
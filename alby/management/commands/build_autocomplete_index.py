@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import translation
+from alby.autocomplete import get_prefix_index, get_terms, PrefixIndex
+from alby.models import Product, ProductList, SofaVariant
+
+
+class Command(BaseCommand):
+    help = "Write the prefix index of product names, captions and product codes used for autocompletion."
+
+    def handle(self, *args, **options):
+        product_codes = dict(ProductList.objects.values_list('id', 'product_code'))
+        variant_codes = list(SofaVariant.objects.filter(product_model__active=True).values_list(
+            'product_model_id', 'product_code__product_code'))
+        for language, _name in settings.LANGUAGES:
+            entries = [(code.lower(), pk) for pk, code in variant_codes if code]
+            with translation.override(language):
+                for product in Product.objects.filter(active=True):
+                    product.set_current_language(language)
+                    entries.extend((term, product.pk) for term in get_terms(product.product_name))
+                    caption = product.safe_translation_getter('caption', default='', any_language=True)
+                    entries.extend((term, product.pk) for term in get_terms(caption))
+                    code = product_codes.get(getattr(product, 'product_code_id', None))
+                    if code:
+                        entries.append((code.lower(), product.pk))
+            count = PrefixIndex.write(get_prefix_index(language).path, entries)
+            if options['verbosity'] > 1:
+                self.stdout.write("Wrote {} terms for language '{}'.".format(count, language))
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import threading
+import time
+from queue import Empty, PriorityQueue, Queue
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from post_office.connections import connections
+from post_office.models import Email, Log, STATUS
+from post_office.settings import get_backend, get_batch_size, get_log_level
+from alby.system.locks import fence
+
+logger = logging.getLogger('alby')
+
+
+class UnopenedConnections(dict):
+    """
+    Connections of post_office in the thread preparing the messages, which unlike post_office's
+    are not opened, since the messages are sent over the connections of the senders.
+    """
+    def __missing__(self, alias):
+        self[alias] = get_connection(get_backend(alias))
+        return self[alias]
+
+
+class Sender(threading.Thread):
+    """
+    Thread sending the messages of the outbox through its own connections to the mail servers,
+    which are kept open until the outbox is closed.
+    """
+    def __init__(self, outbox, results):
+        super(Sender, self).__init__(daemon=True)
+        self.outbox = outbox
+        self.results = results
+        self.connections = {}
+
+    def get_connection(self, alias):
+        if alias not in self.connections:
+            self.connections[alias] = get_connection(get_backend(alias))
+            self.connections[alias].open()
+        return self.connections[alias]
+
+    def close_connection(self, alias):
+        connection = self.connections.pop(alias, None)
+        if connection:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def run(self):
+        while True:
+            key, email, message = self.outbox.get()
+            if email is None:
+                break
+            alias = email.backend_alias or 'default'
+            try:
+                message.connection = self.get_connection(alias)
+                message.send()
+            except Exception as exc:
+                # the connection may be broken, open a new one for the next message
+                self.close_connection(alias)
+                self.results.put((email, exc))
+            else:
+                self.results.put((email, None))
+        for alias in list(self.connections):
+            self.close_connection(alias)
+
+
+class Command(BaseCommand):
+    name = 'dispatch_queued_mail'
+    help = """
+Send the queued mails of post_office through a pool of persistent connections, mails of higher
+priority first, until no mail is left in the queue.
+"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections',
+            type=int,
+            default=4,
+            help="Number of mails sent in parallel, each over its own connection.",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=get_batch_size(),
+            help="Maximum number of mails prepared ahead of sending.",
+        )
+
+    def handle(self, *args, **options):
+        self.log_level = get_log_level()
+        outbox, results = PriorityQueue(), Queue()
+        senders = [Sender(outbox, results) for _ in range(options['connections'])]
+        for sender in senders:
+            sender.start()
+        # prepare_email_message() binds the post_office connection of this thread, which would be
+        # opened otherwise, failing every mail as if it were faulty while the mail server is down
+        previous_connections = getattr(connections._connections, 'connections', None)
+        connections._connections.connections = UnopenedConnections()
+
+        started_at = time.time()
+        self.sent, self.failed = 0, 0
+        counter = itertools.count()
+        try:
+            self.dispatch(options['batch_size'], outbox, results, counter)
+        finally:
+            # mails not handed to a sender yet remain queued for the next run
+            try:
+                while True:
+                    outbox.get_nowait()
+            except Empty:
+                pass
+            for _ in senders:
+                outbox.put(((1, next(counter)), None, None))
+            for sender in senders:
+                sender.join()
+            if previous_connections is None:
+                del connections._connections.connections
+            else:
+                connections._connections.connections = previous_connections
+
+        elapsed = time.time() - started_at
+        if self.sent or self.failed:
+            msg = "Sent {} mails, {} failed, in {:.1f}s ({:.1f} mails/s) over {} connections".format(
+                self.sent, self.failed, elapsed, self.sent / elapsed, len(senders))
+            logger.info(msg)
+            self.stdout.write(msg)
+
+    def dispatch(self, batch_size, outbox, results, counter):
+        """
+        Hand the queued mails over to the senders, at most ``batch_size`` at a time, and record
+        their outcome, until no mail is left.
+        """
+        in_flight = set()
+        while True:
+            # stop handing out mails, once another replica has taken over the job
+            with transaction.atomic():
+                fence(self.name)
+            free = batch_size - len(in_flight)
+            emails = list(self.get_queued().exclude(pk__in=in_flight)[:free]) if free > 0 else []
+            for email in emails:
+                try:
+                    message = email.prepare_email_message()
+                except Exception as exc:
+                    # e.g. a faulty template
+                    results.put((email, exc))
+                else:
+                    # higher priorities go first, otherwise in order of creation
+                    outbox.put(((-(email.priority or 0), next(counter)), email, message))
+                in_flight.add(email.pk)
+            if not in_flight:
+                return
+            in_flight.difference_update(self.record_results(results, block=not emails))
+
+    def get_queued(self):
+        return Email.objects.filter(status=STATUS.queued).filter(
+            Q(scheduled_time__lte=timezone.now()) | Q(scheduled_time=None)
+        ).select_related('template').prefetch_related('attachments').order_by('-priority', 'pk')
+
+    def record_results(self, results, block):
+        """
+        Store the outcome of the mails sent meanwhile, waiting for at least one if ``block`` is
+        set. Return the primary keys of the mails concerned.
+        """
+        done = []
+        try:
+            done.append(results.get(timeout=1 if block else 0.01))
+            while True:
+                done.append(results.get_nowait())
+        except Empty:
+            pass
+
+        sent = [email for email, exc in done if exc is None]
+        failed = [(email, exc) for email, exc in done if exc is not None]
+        for email, exc in failed:
+            logger.warning("Failed to send mail #{}: {}".format(email.pk, exc))
+        # log level 0 logs nothing, 1 only failures and 2 both, as post_office does
+        logs = []
+        if self.log_level >= 1:
+            logs.extend(Log(email=email, status=STATUS.failed, message=str(exc),
+                            exception_type=type(exc).__name__) for email, exc in failed)
+        if self.log_level == 2:
+            logs.extend(Log(email=email, status=STATUS.sent) for email in sent)
+        with transaction.atomic():
+            fence(self.name)
+            if sent:
+                Email.objects.filter(pk__in=[email.pk for email in sent]).update(status=STATUS.sent)
+            if failed:
+                Email.objects.filter(pk__in=[email.pk for email, exc in failed]).update(status=STATUS.failed)
+            if logs:
+                Log.objects.bulk_create(logs)
+        self.sent += len(sent)
+        self.failed += len(failed)
+        return [email.pk for email, exc in done]
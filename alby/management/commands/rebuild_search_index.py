@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections as db_connections
+from django.utils import timezone
+from elasticsearch import TransportError
+from haystack import connections
+from haystack.backends.elasticsearch_backend import ElasticsearchSearchBackend
+from alby.search_backends import SQLiteSearchBackend
+from alby.search_signals import get_identifier, update_search_index
+from alby.system.cache import bump_catalog_version
+
+
+def index_chunk(using, index_name, model_label, first_pk, last_pk):
+    """
+    Prepare and bulk-post the search documents of the products with a primary key in the given
+    range into the index ``index_name``. Runs inside a process of the pool.
+    """
+    engine = connections[using]
+    # never share the HTTP connections to Elasticsearch with the parent process
+    backend = engine.backend(using, **engine.options)
+    backend = getattr(backend, 'primary', backend)
+    backend.index_name = index_name
+    for index in engine.get_unified_index().get_indexes().values():
+        if index.get_model()._meta.label_lower == model_label:
+            products = list(index.index_queryset(using=using).filter(pk__gte=first_pk, pk__lte=last_pk))
+            backend.update(index, products, commit=False)
+            return len(products)
+    return 0
+
+
+class Command(BaseCommand):
+    help = """
+Rebuild the search index in parallel. Products are split into chunks of primary keys, whose
+documents are prepared by a pool of processes and posted into a new Elasticsearch index.
+Finally the index alias is swapped onto the new index, so searches never see a partial index.
+A SQLite index is likewise built in a new file, which then replaces the current one.
+"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help="Number of processes preparing the search documents.",
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help="Number of products per chunk.",
+        )
+
+    def handle(self, *args, **options):
+        for using in connections.connections_info:
+            backend = connections[using].get_backend()
+            started_at = timezone.now()
+            self.indexed_pks = {}
+            # a FallbackSearchBackend is rebuilt one backend after the other
+            primary, fallback = getattr(backend, 'primary', backend), getattr(backend, 'fallback', None)
+            if isinstance(primary, ElasticsearchSearchBackend):
+                if isinstance(fallback, SQLiteSearchBackend):
+                    self.rebuild_serially(using, fallback, options['chunk_size'])
+                self.rebuild(using, primary, options['workers'], options['chunk_size'])
+            elif isinstance(primary, SQLiteSearchBackend):
+                self.rebuild_serially(using, primary, options['chunk_size'])
+            else:
+                call_command('rebuild_index', using=[using], interactive=False, verbosity=options['verbosity'])
+                continue
+            self.update_changed(using, started_at)
+        # search responses cached before may differ from those of the rebuilt index
+        bump_catalog_version()
+
+    def get_chunks(self, using, chunk_size):
+        chunks = []
+        for index in connections[using].get_unified_index().get_indexes().values():
+            model_label = index.get_model()._meta.label_lower
+            pks = list(index.index_queryset(using=using).order_by('pk').values_list('pk', flat=True))
+            self.indexed_pks[model_label] = set(pks)
+            for offset in range(0, len(pks), chunk_size):
+                chunk = pks[offset:offset + chunk_size]
+                chunks.append((model_label, chunk[0], chunk[-1]))
+        return chunks
+
+    def rebuild_serially(self, using, backend, chunk_size):
+        """
+        Build the SQLite index in a new file, which replaces the current one once complete, so
+        that searches never see a partial index.
+        """
+        replacement = backend.create_replacement()
+        indexed = 0
+        for index in connections[using].get_unified_index().get_indexes().values():
+            pks = list(index.index_queryset(using=using).order_by('pk').values_list('pk', flat=True))
+            self.indexed_pks[index.get_model()._meta.label_lower] = set(pks)
+            for offset in range(0, len(pks), chunk_size):
+                products = list(index.index_queryset(using=using).filter(pk__in=pks[offset:offset + chunk_size]))
+                replacement.update(index, products)
+                indexed += len(products)
+        backend.replace_with(replacement)
+        self.stdout.write("Indexed {} products into {}.".format(indexed, replacement.path))
+
+    def rebuild(self, using, backend, workers, chunk_size):
+        alias = backend.index_name
+        index_name = '{}-{:%Y%m%d%H%M%S}'.format(alias, timezone.now())
+        chunks = self.get_chunks(using, chunk_size)
+
+        # create the new index with the settings and mapping Haystack would use
+        backend.index_name = index_name
+        backend.setup_complete = False
+        backend.setup()
+        backend.index_name = alias
+
+        # forked processes must open their own database connections
+        db_connections.close_all()
+        indexed = 0
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(index_chunk, using, index_name, *chunk) for chunk in chunks]
+            for future in futures:
+                indexed += future.result()
+        backend.conn.indices.refresh(index=index_name)
+        self.swap_alias(backend.conn, alias, index_name)
+        self.stdout.write("Indexed {} products into {} for {}.".format(indexed, index_name, alias))
+
+    def update_changed(self, using, started_at):
+        """
+        Update the documents of products saved while rebuilding, which may have been written
+        into the previous index, and remove those of products deleted meanwhile.
+        """
+        changed = []
+        for index in connections[using].get_unified_index().get_indexes().values():
+            model = index.get_model()
+            changed.extend(get_identifier(model, pk) for pk in model.objects.filter(
+                updated_at__gte=started_at).values_list('pk', flat=True))
+            existing = set(index.index_queryset(using=using).values_list('pk', flat=True))
+            changed.extend(get_identifier(model, pk)
+                           for pk in self.indexed_pks.get(model._meta.label_lower, set()) - existing)
+        if changed:
+            update_search_index(changed)
+
+    def swap_alias(self, conn, alias, index_name):
+        """
+        Point ``alias`` onto ``index_name`` in one atomic operation and drop the indices it
+        referred to before.
+        """
+        if conn.indices.exists_alias(name=alias):
+            previous = list(conn.indices.get_alias(name=alias))
+        else:
+            previous = []
+            if conn.indices.exists(index=alias):
+                # the index has been created by Haystack, it must be replaced by the alias
+                self.replace_index(conn, alias, index_name)
+                return
+        actions = [{'remove': {'index': name, 'alias': alias}} for name in previous]
+        actions.append({'add': {'index': index_name, 'alias': alias}})
+        conn.indices.update_aliases(body={'actions': actions})
+        for name in previous:
+            conn.indices.delete(index=name)
+
+    def replace_index(self, conn, alias, index_name):
+        """
+        Drop the concrete index ``alias`` and add the alias in the same request, so that there
+        always is an index to search. Should Elasticsearch not support removing an index through
+        the aliases API, both steps are done one after the other.
+        """
+        actions = [
+            {'remove_index': {'index': alias}},
+            {'add': {'index': index_name, 'alias': alias}},
+        ]
+        try:
+            conn.indices.update_aliases(body={'actions': actions})
+        except TransportError as exc:
+            self.stderr.write("Replacing index {} in one step failed: {}".format(alias, exc))
+            conn.indices.delete(index=alias)
+            conn.indices.update_aliases(body={'actions': actions[1:]})
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from alby.models import ProductList
+from alby.signals import PRODUCT_CODE_MODELS
+
+
+class Command(BaseCommand):
+    help = "Delete ProductList entries which are not referenced by any product or variant."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help="Only count the orphaned entries, do not delete them.",
+        )
+
+    def handle(self, *args, **options):
+        orphans = ProductList.objects.all()
+        for model in PRODUCT_CODE_MODELS:
+            orphans = orphans.exclude(pk__in=model._base_manager.values('product_code_id'))
+        if options['dry_run']:
+            self.stdout.write("Found {} orphaned product codes.".format(orphans.count()))
+            return
+        deleted, _ = orphans.delete()
+        self.stdout.write("Deleted {} orphaned product codes.".format(deleted))
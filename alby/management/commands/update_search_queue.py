@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from alby.search_signals import SearchQueue
+from alby.system.redis import get_redis_connection
+
+
+class Command(BaseCommand):
+    help = "Update the search documents of all products changed since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help="Number of products updated per round trip to the search engine.",
+        )
+
+    def handle(self, *args, **options):
+        connection = get_redis_connection()
+        if connection is None:
+            raise CommandError("The search queue requires Redis, see settings.SESSION_REDIS.")
+        processed = SearchQueue(connection).drain(options['batch_size'])
+        if processed and options['verbosity'] > 1:
+            self.stdout.write("Updated the search documents of {} products.".format(processed))
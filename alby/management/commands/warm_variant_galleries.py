@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from alby.models import SofaModel, SofaVariant
+
+
+class Command(BaseCommand):
+    help = """
+Build the galleries of all sofa variants missing in the cache, generating their thumbnails, e.g.
+after the cache has been flushed, so that product pages do not show the default image meanwhile.
+"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            dest='rebuild_all',
+            help="Rebuild the galleries of all variants, including those found in the cache.",
+        )
+
+    def handle(self, *args, **options):
+        variants = dict(SofaVariant.objects.values_list('pk', 'product_model_id'))
+        if options['rebuild_all']:
+            missing = list(variants)
+        else:
+            cached = cache.get_many([SofaVariant.get_gallery_cache_key(pk) for pk in variants])
+            missing = [pk for pk in variants if SofaVariant.get_gallery_cache_key(pk) not in cached]
+        for pk in missing:
+            SofaVariant.update_gallery(pk)
+        SofaModel.invalidate_variant_matrix(set(variants[pk] for pk in missing))
+        self.stdout.write("Built the galleries of {} sofa variants.".format(len(missing)))
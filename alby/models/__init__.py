@@ -3,6 +3,9 @@ from shop.models.defaults.order_item import OrderItem
 from alby.models.address import ShippingAddress
 from .customer import Customer
 from .discount import Discount
+from .shipping import ShippingRate
+from .scheduling import ScheduledRun
+from .sku import SkuCounter
 from .models import CommodityInventory, Lamel, LamelInventory, SofaModel, SofaVariant, ProductList
 from .models import Product, Commodity, Fabric, VariantImage
 
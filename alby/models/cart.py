@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from decimal import Decimal, InvalidOperation
 from django.db.models import SET_DEFAULT
 
 from shop import deferred
@@ -28,15 +29,49 @@ class Cart(BaseCart):
         related_name='+',
     )
 
+    def __init__(self, *args, **kwargs):
+        super(Cart, self).__init__(*args, **kwargs)
+        self._total_weight = None
+
+    def save(self, *args, **kwargs):
+        self._total_weight = None
+        super(Cart, self).save(*args, **kwargs)
+
+    def update(self, request, raise_exception=False):
+        if self._dirty:
+            self._total_weight = None
+        super(Cart, self).update(request, raise_exception)
+
     @property
     def total_weight(self):
         """
         Returns the total weight of all items in the cart (for Shipping Services).
+        The weight is computed once and memoized until the cart items change.
+        """
+        if self._total_weight is None:
+            if self._cached_cart_items is None:
+                lines = list(self.items.filter(quantity__gt=0).values_list('product_id', 'quantity'))
+            else:
+                lines = [(item.product_id, item.quantity) for item in self._cached_cart_items]
+            product_model = self.items.model._meta.get_field('product').related_model
+            products = product_model.objects.in_bulk(set(pk for pk, quantity in lines))
+            self._total_weight = self.compute_weight(lines, products)
+        return self._total_weight
+
+    @total_weight.setter
+    def total_weight(self, value):
+        self._total_weight = value
+
+    @staticmethod
+    def compute_weight(lines, products):
+        """
+        Sum up the weight in kg of the given ``(product_id, quantity)`` lines. Products are taken
+        from the dictionary ``products``, those without a valid weight are ignored.
         """
-        rez = 0
-        for item in self.items.all():
+        total = Decimal(0)
+        for product_id, quantity in lines:
             try:
-                rez += float(item.product.weight) * item.quantity
-            except:
-                pass
-        return float("{0:.2f}".format(rez))
+                total += Decimal(str(products[product_id].weight)) * quantity
+            except (KeyError, AttributeError, InvalidOperation):
+                continue
+        return total.quantize(Decimal('0.01'))
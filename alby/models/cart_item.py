@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db.models import Index, PositiveIntegerField
+from django.utils.translation import ugettext_lazy as _
+from shop.models import cart
+
+
+class CartItem(cart.BaseCartItem):
+    """Materialized model for CartItem, indexed to look up product variants in a cart"""
+    quantity = PositiveIntegerField()
+
+    class Meta:
+        verbose_name = _("Cart item")
+        verbose_name_plural = _("Cart items")
+        indexes = [Index(fields=['cart', 'product', 'product_code'], name='alby_cartitem_variant_idx')]
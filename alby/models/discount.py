@@ -1,6 +1,40 @@
+import logging
+from bisect import bisect_right
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
+logger = logging.getLogger('alby')
+
+# compiled tiers per Discount primary key, as tuple ``(discont_scheme, tiers)``
+_compiled_schemes = {}
+
+
+def parse_discount_scheme(scheme):
+    """
+    Parse a discount scheme such as ``"10:5\\r\\n50:10"`` into a tuple of quantity thresholds and
+    a tuple of rebates in percent, both sorted by quantity.
+    """
+    tiers = {}
+    for lineno, line in enumerate(scheme.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            quantity, rebate = [int(bit) for bit in line.split(':')]
+        except ValueError:
+            msg = _("Line {0}: expected 'quantity:rebate', got '{1}'.")
+            raise ValidationError(msg.format(lineno, line))
+        if quantity < 0 or not 0 <= rebate <= 100:
+            msg = _("Line {0}: quantity must be positive and rebate between 0 and 100%.")
+            raise ValidationError(msg.format(lineno))
+        if quantity in tiers:
+            msg = _("Line {0}: quantity {1} is listed twice.")
+            raise ValidationError(msg.format(lineno, quantity))
+        tiers[quantity] = rebate
+    quantities = tuple(sorted(tiers))
+    return quantities, tuple(tiers[q] for q in quantities)
+
 
 class Discount(models.Model):
     discount_name = models.CharField(_("Discount name"), max_length=100)
@@ -8,3 +42,43 @@ class Discount(models.Model):
 
     def __str__(self):
         return self.discount_name
+
+    def clean(self):
+        try:
+            parse_discount_scheme(self.discont_scheme)
+        except ValidationError as err:
+            raise ValidationError({'discont_scheme': err.messages})
+
+    def save(self, *args, **kwargs):
+        tiers = parse_discount_scheme(self.discont_scheme)
+        super(Discount, self).save(*args, **kwargs)
+        _compiled_schemes[self.pk] = (self.discont_scheme, tiers)
+
+    def get_tiers(self):
+        """
+        Return the parsed scheme as ``(quantities, rebates)``. The scheme is parsed only once per
+        process and reparsed whenever its text changes.
+        """
+        compiled = _compiled_schemes.get(self.pk)
+        if compiled is None or compiled[0] != self.discont_scheme:
+            try:
+                tiers = parse_discount_scheme(self.discont_scheme)
+            except ValidationError as err:
+                logger.warning("Ignoring invalid discount scheme '%s': %s", self, err.messages)
+                tiers = ((), ())
+            compiled = (self.discont_scheme, tiers)
+            if self.pk:
+                _compiled_schemes[self.pk] = compiled
+        return compiled[1]
+
+    def get_rebate(self, quantity):
+        """
+        Return the rebate in percent for the given quantity.
+        """
+        quantities, rebates = self.get_tiers()
+        index = bisect_right(quantities, int(quantity))
+        return rebates[index - 1] if index else 0
+
+    @classmethod
+    def invalidate_tiers(cls, pk):
+        _compiled_schemes.pop(pk, None)
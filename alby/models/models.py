@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import hashlib
+import json
 from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.utils.translation import ugettext_lazy as _
+from django.db import models, transaction, IntegrityError
+from django.utils.translation import get_language, ugettext_lazy as _
 from django.utils.encoding import python_2_unicode_compatible
 from djangocms_text_ckeditor.fields import HTMLField
 from polymorphic.query import PolymorphicQuerySet
@@ -17,13 +21,15 @@ from shop.money.fields import MoneyField
 from shop.models.product import BaseProduct, BaseProductManager, CMSPageReferenceMixin
 from shop.models.inventory import BaseInventory, AvailableProductMixin
 from alby.models.cart import Cart
-from shop.models.defaults.cart_item import CartItem
+from alby.models.cart_item import CartItem
 from shop.models.defaults.delivery import Delivery
 from shop.models.defaults.delivery_item import DeliveryItem
 from shop.models.defaults.mapping import ProductPage, ProductImage
 from alby.models.address import BillingAddress, ShippingAddress
 from alby.models.customer import Customer
 from alby.models.discount import Discount
+from alby.models.sku import SkuAllocator, SkuCounter
+from alby.system.cache import get_request_cache
 from shop.money import Money
 from filer.fields import image
 
@@ -39,7 +45,36 @@ class ProductManager(BaseProductManager, TranslatableManager):
         qs = self.queryset_class(self.model, using=self._db)
         return qs.prefetch_related('translations')
 
+
+class ProductListManager(models.Manager):
+    def allocate(self, product_model, count):
+        """
+        Create ``count`` entries for ``product_model`` using one block of product codes and a
+        single ``INSERT``. Use this for bulk imports, instead of saving entries one by one.
+        """
+        entries = [self.model(product_code=self.model.set_num_scu(number, self.model.SCU_DIGITS),
+                              product_model=product_model)
+                   for number in product_code_allocator.allocate(count)]
+        return self.bulk_create(entries)
+
+    def assign(self, instances):
+        """
+        Pre-assign product codes to unsaved products or variants before they are bulk created,
+        using one ``INSERT`` per product model.
+        """
+        pending = {}
+        for instance in instances:
+            if not instance.product_code_id:
+                pending.setdefault(instance.__class__.__name__, []).append(instance)
+        for product_model, group in pending.items():
+            for instance, entry in zip(group, self.allocate(product_model, len(group))):
+                instance.product_code = entry
+        return instances
+
+
 class ProductList(models.Model):
+    SCU_DIGITS = 4
+
     product_code = models.CharField(
         _("Product model"),
         max_length=255,
@@ -50,11 +85,11 @@ class ProductList(models.Model):
         max_length=255,
         blank=True,
     )
-    def is_unique_scu(self, scu):
-        scu = str(scu)
-        return ProductList.objects.filter(product_code=scu).count() == 0
 
-    def set_num_scu(self, scu, n):
+    objects = ProductListManager()
+
+    @staticmethod
+    def set_num_scu(scu, n):
         scu = str(scu)
         while len(scu) <= int(n):
             scu = '0' + scu
@@ -64,23 +99,29 @@ class ProductList(models.Model):
         max_scu = ProductList.objects.aggregate(models.Max('product_code'))
         try:
             return int(max_scu['product_code__max'])
-        except:
+        except (TypeError, ValueError):
             return 1
 
     def save(self, *args, **kwargs):
-        if not self.product_code:
-            max_scu = self.get_max_scu()
-            while True:
-                new_scu = max_scu + 1
-                if self.is_unique_scu(new_scu):
-                    self.product_code = self.set_num_scu(new_scu, 4)
-                    break
-        super(ProductList, self).save(*args, **kwargs)
+        if self.product_code:
+            return super(ProductList, self).save(*args, **kwargs)
+        for attempt in range(3):
+            self.product_code = self.set_num_scu(product_code_allocator.allocate()[0], self.SCU_DIGITS)
+            try:
+                with transaction.atomic():
+                    return super(ProductList, self).save(*args, **kwargs)
+            except IntegrityError:
+                # the code is already in use, e.g. entered by hand
+                product_code_allocator.discard()
+        raise IntegrityError("Unable to allocate a unique product code")
 
     def __str__(self):
         return self.product_code
 
 
+product_code_allocator = SkuAllocator(SkuCounter.PRODUCT_CODE, initial=lambda: ProductList().get_max_scu())
+
+
 @python_2_unicode_compatible
 class Product(CMSPageReferenceMixin, TranslatableModelMixin, BaseProduct):
     """
@@ -315,17 +356,38 @@ class Lamel(AvailableProductMixin, Product):
         return self.unit_price
 
     def get_rebate(self, x):
-        some_str = self.discont_scheme.discont_scheme.split("\r\n")
-        x = int(x)
-        temp_discont = 0
-        for i in some_str:
-            discont = i.split(":")
-            num = int(discont[0])  # get first element of tuple for get quantity in db
-            if x >= num:
-                temp_discont = int(discont[1])
-            elif x <= num:
-                return temp_discont
-        return temp_discont
+        if not self.discont_scheme_id:
+            return 0
+        return self.discont_scheme.get_rebate(x)
+
+    def get_price_curve(self, request):
+        """
+        Return the unit price for every quantity tier of the discount scheme as plain decimals,
+        so that the client can price any quantity on its own. The result is cached per product and scheme version,
+        outdated versions expire after ``settings.ALBY_PRICE_CURVE_CACHE_TTL`` seconds.
+        """
+        unit_price = self.get_price(request)
+        scheme = self.discont_scheme.discont_scheme if self.discont_scheme_id else ''
+        version = hashlib.md5('{}|{}'.format(unit_price.as_decimal(), scheme).encode('utf-8')).hexdigest()
+        cache_key = 'alby:price-curve:{}:{}'.format(self.pk, version)
+        curve = cache.get(cache_key)
+        if curve is None:
+            tiers = list(zip(*self.discont_scheme.get_tiers())) if self.discont_scheme_id else []
+            if not tiers or tiers[0][0] > 1:
+                tiers.insert(0, (1, 0))
+            # plain decimals, since formatting Money localizes the amount
+            curve = {
+                'product': self.pk,
+                'version': version,
+                'unit_price': str(unit_price.as_decimal()),
+                'tiers': [{
+                    'quantity': quantity,
+                    'rebate': rebate,
+                    'unit_price': str((unit_price - (unit_price * rebate) / 100).as_decimal()),
+                } for quantity, rebate in tiers],
+            }
+            cache.set(cache_key, curve, getattr(settings, 'ALBY_PRICE_CURVE_CACHE_TTL', 86400))
+        return curve
 
 class LamelInventory(BaseInventory):
     product = models.ForeignKey(
@@ -407,6 +469,42 @@ class Fabric(Product):
     def get_price(self, request):
         return self.unit_price
 
+    @staticmethod
+    def get_details_cache_key(product_code, language):
+        return 'alby:fabric-details:{}:{}'.format(product_code, language)
+
+    @classmethod
+    def get_details(cls, product_codes, language=None):
+        """
+        Return a dict mapping each of the given product codes onto the name, type, composition,
+        care and translated description of its fabric. Each fabric is cached separately, and
+        all fabrics missing in the cache are fetched together.
+        """
+        language = language or get_language()
+        keys = dict((cls.get_details_cache_key(code, language), code) for code in product_codes)
+        details = dict((keys[key], value) for key, value in cache.get_many(list(keys)).items())
+        missing = [code for code in product_codes if code not in details]
+        if missing:
+            queryset = cls.objects.filter(product_code__product_code__in=missing)
+            queryset = queryset.select_related('product_code').prefetch_related('translations')
+            fetched = {}
+            for fabric in queryset:
+                fabric.set_current_language(language)
+                code = fabric.product_code.product_code
+                details[code] = fetched[cls.get_details_cache_key(code, language)] = {
+                    'fabric_name': fabric.product_name,
+                    'fabric_type': fabric.fabric_type,
+                    'composition': fabric.composition,
+                    'care': fabric.care,
+                    'description': fabric.safe_translation_getter('description', default='', any_language=True),
+                }
+            cache.set_many(fetched, None)
+        return details
+
+    def invalidate_details(self):
+        cache.delete_many([self.get_details_cache_key(self.product_code.product_code, language)
+                           for language, _name in settings.LANGUAGES])
+
 class SofaModel(Product):
     sofa_type = models.CharField(
         _("Sofa Type"),
@@ -430,33 +528,138 @@ class SofaModel(Product):
         ),
     )
     # other fields to map the specification sheet
+    price_from = MoneyField(
+        _("Price from"),
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_("Lowest unit price of all variants, updated whenever a variant changes."),
+    )
 
     default_manager = ProductManager()
 
     lookup_fields = ('product_name__icontains',)
 
     def get_price(self, request):
+        if self.price_from is not None:
+            return self.price_from
         aggregate = self.variants.aggregate(models.Min('unit_price'))
         return Money(aggregate['unit_price__min'])
 
+    def get_lowest_variant_price(self):
+        return self.variants.aggregate(models.Min('unit_price'))['unit_price__min']
+
+    def update_price_from(self):
+        """
+        Store the lowest unit price of all variants in ``price_from``.
+        """
+        self.price_from = self.get_lowest_variant_price()
+        SofaModel.objects.filter(pk=self.pk).update(price_from=self.price_from)
+
+    def save(self, *args, **kwargs):
+        # an instance loaded before a variant changed, e.g. by an admin form, would write back
+        # an outdated price
+        if self.pk:
+            self.price_from = self.get_lowest_variant_price()
+        super(SofaModel, self).save(*args, **kwargs)
+
     def is_in_cart(self, cart, watched=False, **kwargs):
         try:
             product_code = kwargs['product_code']
         except KeyError:
             return
-        cart_item_qs = CartItem.objects.filter(cart=cart, product=self)
-        for cart_item in cart_item_qs:
-            if cart_item.product_code == product_code:
-                return cart_item
+        return CartItem.objects.filter(cart=cart, product=self, product_code=product_code).first()
+
+    def has_in_cart(self, cart, product_code, request=None):
+        """
+        Check if the variant ``product_code`` is in the given cart. The codes of all items in the
+        cart are loaded once per request, so that repeated checks are answered from memory.
+        """
+        return product_code in self.get_codes_in_cart(cart, request)
+
+    def get_codes_in_cart(self, cart, request=None):
+        """
+        Return the product codes of all variants of this sofa in the given cart.
+        """
+        if cart is None:
+            return []
+        cart_codes = get_request_cache(request, 'cart_product_codes')
+        if cart.pk not in cart_codes:
+            cart_codes[cart.pk] = set(CartItem.objects.filter(cart=cart).values_list('product_id', 'product_code'))
+        return [code for pk, code in cart_codes[cart.pk] if pk == self.pk]
+
+    def get_variant_matrix(self):
+        """
+        Return a document describing all variants of this sofa, their fabric, product code, price
+        and gallery, so that the client can switch between variants without asking the server.
+        The document is cached until a variant, one of its images or fabrics changes, or only
+        briefly while galleries are missing in the cache and being built by the worker.
+        """
+        cache_key = self.get_variant_matrix_cache_key(self.pk)
+        matrix = cache.get(cache_key)
+        if matrix is None:
+            variants = list(self.variants.select_related('product_code', 'fabric__product_code'))
+            galleries = cache.get_many([SofaVariant.get_gallery_cache_key(v.pk) for v in variants])
+            matrix = {'product': self.pk, 'variants': []}
+            complete = True
+            for variant in variants:
+                gallery = galleries.get(SofaVariant.get_gallery_cache_key(variant.pk))
+                if gallery is None:
+                    SofaVariant.request_gallery(variant.pk)
+                    complete = False
+                matrix['variants'].append({
+                    'product_code': variant.product_code.product_code,
+                    'unit_price': str(variant.unit_price),
+                    'fabric': variant.fabric.fabric_name,
+                    'fabric_code': variant.fabric.product_code.product_code,
+                    'img': gallery or SofaVariant.DEFAULT_GALLERY,
+                })
+            content = json.dumps(matrix, sort_keys=True).encode('utf-8')
+            matrix['etag'] = hashlib.md5(content).hexdigest()
+            cache.set(cache_key, matrix, None if complete else 60)
+        return matrix
+
+    @staticmethod
+    def get_variant_matrix_cache_key(pk):
+        return 'alby:variant-matrix:{}'.format(pk)
+
+    @classmethod
+    def invalidate_variant_matrix(cls, pks):
+        cache.delete_many([cls.get_variant_matrix_cache_key(pk) for pk in pks])
 
     def get_product_variant(self, **kwargs):
-        try:
-            product_code = kwargs.get('product_code')
-            #added new model for the whole product list
-            id_var = ProductList.objects.get(product_code=product_code).id
-            return self.variants.get(product_code=id_var)
-        except SofaVariant.DoesNotExist as e:
-            raise SofaModel.DoesNotExist(e)
+        """
+        Return the variant for the given ``product_code``. Pass the ``request`` to memoize the
+        variant for the remaining request.
+        """
+        product_code = kwargs.get('product_code')
+        variants = get_request_cache(kwargs.get('request'), 'sofa_variants')
+        key = (self.pk, product_code)
+        if key not in variants:
+            try:
+                variants[key] = self.variants.select_related('product_code', 'fabric').get(
+                    product_code__product_code=product_code)
+            except SofaVariant.DoesNotExist as e:
+                raise SofaModel.DoesNotExist(e)
+        return variants[key]
+
+    @classmethod
+    def prefetch_product_variants(cls, request, keys):
+        """
+        Resolve the variants for many ``(product_id, product_code)`` pairs using a single query,
+        so that subsequent calls to ``get_product_variant`` during this request are served from
+        memory.
+        """
+        variants = get_request_cache(request, 'sofa_variants')
+        missing = [key for key in keys if key not in variants]
+        if not missing:
+            return
+        queryset = SofaVariant.objects.select_related('product_code', 'fabric').filter(
+            product_model_id__in=set(pk for pk, code in missing),
+            product_code__product_code__in=set(code for pk, code in missing),
+        )
+        for variant in queryset:
+            variants[(variant.product_model_id, variant.product_code.product_code)] = variant
 
 
 class SofaVariant(models.Model):
@@ -491,6 +694,45 @@ class SofaVariant(models.Model):
     def __str__(self):
         return self.fabric.fabric_name
 
+    DEFAULT_GALLERY = 'default_img'
+
+    @staticmethod
+    def get_gallery_cache_key(pk):
+        return 'alby:variant-gallery:{}'.format(pk)
+
+    def get_gallery(self):
+        """
+        Return the ``[image_url, thumbnail_url]`` pairs of this variant's images, or the marker
+        of the default image, if it has none. The list is built ahead of time, whenever a
+        VariantImage changes, so reading it does no image work. If it is missing in the cache,
+        the default image is shown until the worker has rebuilt it.
+        """
+        gallery = cache.get(self.get_gallery_cache_key(self.pk))
+        if gallery is None:
+            self.request_gallery(self.pk)
+        return gallery or self.DEFAULT_GALLERY
+
+    @classmethod
+    def request_gallery(cls, pk):
+        """
+        Let the worker rebuild the missing gallery of the variant, once within five minutes.
+        """
+        from alby.tasks import update_variant_gallery
+
+        if cache.add('alby:variant-gallery-requested:{}'.format(pk), True, 300):
+            update_variant_gallery.delay(pk)
+
+    @classmethod
+    def update_gallery(cls, pk):
+        """
+        Build the image list of the variant with the given primary key, generating missing
+        thumbnails, and store it in the cache.
+        """
+        images = VariantImage.objects.filter(product_id=pk).select_related('image')
+        gallery = [[vi.image.url, vi.image.thumbnails['admin_directory_listing_icon']] for vi in images]
+        cache.set(cls.get_gallery_cache_key(pk), gallery, None)
+        return gallery
+
     def delete(self, using=None, keep_parents=False):
         ProductList.objects.filter(product_code=self.product_code).delete()
         super(SofaVariant, self).delete()
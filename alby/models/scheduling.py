@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class ScheduledRun(models.Model):
+    """
+    Lock of a job run by the worker replicas, see ``alby.system.locks``. Without Redis, it holds
+    the lease on the job and the latest claimed slot. In any case, it holds the fencing token of
+    the latest holder which committed results.
+    """
+    name = models.CharField(
+        _("Job name"),
+        max_length=100,
+        unique=True,
+    )
+    slot = models.PositiveIntegerField(
+        _("Latest claimed slot"),
+        default=0,
+    )
+    claimed_at = models.DateTimeField(
+        _("Claimed at"),
+        auto_now=True,
+    )
+    locked_until = models.DateTimeField(
+        _("Locked until"),
+        null=True,
+        blank=True,
+    )
+    token = models.BigIntegerField(
+        _("Latest lock token"),
+        default=0,
+    )
+    fencing_token = models.BigIntegerField(
+        _("Latest fencing token"),
+        default=0,
+        help_text=_("Token of the latest lock holder which committed results."),
+    )
+
+    class Meta:
+        verbose_name = _("Scheduled run")
+        verbose_name_plural = _("Scheduled runs")
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+from bisect import bisect_right
+from decimal import Decimal
+from django.conf import settings
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+from shop.money import Money
+from shop.money.fields import MoneyField
+from alby.system.cache import bump_shared_version, get_shared_version
+
+# sorted weight bands per shipping modifier, as tuple ``(version, expires, weights, amounts)``
+_rate_tables = {}
+
+RATES_VERSION_KEY = 'alby:shipping-rates-version'
+
+
+class ShippingRateManager(models.Manager):
+    def get_table(self, modifier):
+        """
+        Return the weight bands of the given shipping modifier as sorted tuples ``(weights,
+        amounts)``. Tables are kept in memory until the rates version shared by all processes
+        changes, but at most for ``settings.ALBY_SHIPPING_RATES_TTL`` seconds.
+        """
+        version = get_shared_version(RATES_VERSION_KEY)
+        table = _rate_tables.get(modifier)
+        if table is None or table[0] != version or table[1] < time.time():
+            rows = self.filter(modifier=modifier).order_by('min_weight').values_list('min_weight', 'amount')
+            ttl = getattr(settings, 'ALBY_SHIPPING_RATES_TTL', 300)
+            table = (version, time.time() + ttl, tuple(w for w, a in rows), tuple(a for w, a in rows))
+            _rate_tables[modifier] = table
+        return table[2], table[3]
+
+    def get_amount(self, modifier, weight, default_rates=()):
+        """
+        Return the shipping costs for a cart of the given weight in kg. If no rates have been
+        entered for the modifier, the bands ``default_rates`` are used instead. Carts lighter
+        than the first band are charged as the first band.
+        """
+        weights, amounts = self.get_table(modifier)
+        if not weights:
+            if not default_rates:
+                return Money(0)
+            weights = [Decimal(w) for w, a in default_rates]
+            amounts = [Money(a) for w, a in default_rates]
+        index = bisect_right(weights, Decimal(weight))
+        return amounts[max(index - 1, 0)]
+
+    @staticmethod
+    def invalidate():
+        """
+        Outdate the rate tables of all processes.
+        """
+        _rate_tables.clear()
+        bump_shared_version(RATES_VERSION_KEY)
+
+
+class ShippingRate(models.Model):
+    """
+    Weight band for a shipping modifier: carts weighing at least ``min_weight`` are charged with
+    ``amount``, until the next band of the same modifier starts.
+    """
+    SHIPPING_METHODS = [
+        ('postal-shipping', _("Postal shipping")),
+        ('courier-delivery', _("Courier delivery")),
+    ]
+    modifier = models.CharField(
+        _("Shipping method"),
+        max_length=50,
+        choices=SHIPPING_METHODS,
+    )
+    min_weight = models.DecimalField(
+        _("Minimum weight"),
+        max_digits=8,
+        decimal_places=3,
+        default=0,
+        help_text=_("Lower bound of this band in kg"),
+    )
+    amount = MoneyField(
+        _("Shipping costs"),
+    )
+
+    objects = ShippingRateManager()
+
+    class Meta:
+        ordering = ('modifier', 'min_weight')
+        unique_together = [('modifier', 'min_weight')]
+        verbose_name = _("Shipping rate")
+        verbose_name_plural = _("Shipping rates")
+
+    def __str__(self):
+        return "{} >= {} kg".format(self.get_modifier_display(), self.min_weight)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import threading
+from django.conf import settings
+from django.db import connections, models, router, IntegrityError
+from django.utils.translation import ugettext_lazy as _
+
+
+class SkuCounter(models.Model):
+    """
+    Counter row from which product codes are reserved in blocks. Each process reserves a whole
+    block with one locked ``UPDATE`` and then hands out codes from memory.
+    """
+    PRODUCT_CODE = 'product_code'
+
+    name = models.CharField(
+        _("Counter name"),
+        max_length=50,
+        unique=True,
+    )
+    value = models.PositiveIntegerField(
+        _("Last reserved number"),
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = _("SKU counter")
+        verbose_name_plural = _("SKU counters")
+
+    def __str__(self):
+        return self.name
+
+
+class SkuAllocator(object):
+    """
+    Process local allocator handing out numbers from blocks reserved on a :class:`SkuCounter`.
+
+    :param name: Name of the counter row.
+    :param initial: Callable returning the last number already in use. It is only invoked once,
+        when the counter row does not exist yet.
+    :param block_size: Numbers reserved per round trip, defaults to ``settings.ALBY_SKU_BLOCK_SIZE``.
+    """
+    def __init__(self, name, initial=None, block_size=None):
+        self.name = name
+        self.initial = initial
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._next, self._last = 1, 0
+
+    def get_block_size(self):
+        return int(self.block_size or getattr(settings, 'ALBY_SKU_BLOCK_SIZE', 20))
+
+    def reserve(self, count):
+        """
+        Reserve ``count`` consecutive numbers on the counter row and return the first one.
+
+        The reservation is committed on a connection of its own, so that the counter row is
+        neither locked until the caller's transaction ends, nor rolled back with it.
+        """
+        alias = router.db_for_write(SkuCounter)
+        wrapper = connections[alias]
+        connection = wrapper.__class__(wrapper.settings_dict, alias)
+        table = connection.ops.quote_name(SkuCounter._meta.db_table)
+        try:
+            connection.set_autocommit(False)
+            with connection.cursor() as cursor:
+                for attempt in range(2):
+                    cursor.execute('UPDATE {} SET value = value + %s WHERE name = %s'.format(table),
+                                   [count, self.name])
+                    if cursor.rowcount:
+                        cursor.execute('SELECT value FROM {} WHERE name = %s'.format(table), [self.name])
+                        last = cursor.fetchone()[0]
+                        connection.commit()
+                        return last - count + 1
+                    try:
+                        first = int(self.initial()) + 1 if self.initial else 1
+                        cursor.execute('INSERT INTO {} (name, value) VALUES (%s, %s)'.format(table),
+                                       [self.name, first + count - 1])
+                        connection.commit()
+                        return first
+                    except IntegrityError:
+                        # another process created the row in the meantime
+                        connection.rollback()
+            raise IntegrityError("Unable to reserve numbers on counter '{}'".format(self.name))
+        finally:
+            connection.close()
+
+    def allocate(self, count=1):
+        """
+        Return a list of ``count`` unused numbers. The database is only hit when the current
+        block is exhausted.
+        """
+        numbers = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # never share a block with the parent of a forked worker
+                self._reset()
+            while len(numbers) < count:
+                if self._next > self._last:
+                    size = max(self.get_block_size(), count - len(numbers))
+                    self._next = self.reserve(size)
+                    self._last = self._next + size - 1
+                take = min(count - len(numbers), self._last - self._next + 1)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+        return numbers
+
+    def discard(self):
+        """
+        Forget the remaining numbers of the current block. Call this after a collision with a
+        number which has been taken without the counter, for instance entered by hand.
+        """
+        with self._lock:
+            self._reset()
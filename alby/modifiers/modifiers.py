@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 
 from shop.modifiers.base import BaseCartModifier
 from alby.modifiers.providers import PayWhenTake, PayAtPostProvider
+from alby.models import Discount, Product, ShippingRate, SofaModel
+from alby.system.cache import get_request_cache
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from shop.modifiers.pool import cart_modifiers_pool
@@ -16,26 +18,58 @@ from shop.payment.providers import ForwardFundPayment
 
 class PrimaryCartModifier(DefaultCartModifier):
     """
-    Extended default cart modifier which handles the price for product variations
+    Extended default cart modifier which handles the price for product variations.
+
+    Method ``pre_process_cart`` fetches the products, sofa variants and discount schemes of all
+    cart items in bulk, so that each cart item is priced in memory. It also stores the cart's
+    total weight, which the shipping modifiers read afterwards.
     """
 
+    def pre_process_cart(self, cart, request, raise_exception=False):
+        lines = list(cart.items.filter(quantity__gt=0).values_list('product_id', 'product_code', 'quantity'))
+        products = get_request_cache(request, 'cart_products')
+        missing = set(pk for pk, code, quantity in lines).difference(products)
+        if missing:
+            fetched = list(Product.objects.filter(pk__in=missing))
+            discounts = Discount.objects.in_bulk(set(
+                p.discont_scheme_id for p in fetched if getattr(p, 'discont_scheme_id', None)))
+            for product in fetched:
+                if getattr(product, 'discont_scheme_id', None):
+                    product.discont_scheme = discounts[product.discont_scheme_id]
+                products[product.pk] = product
+        SofaModel.prefetch_product_variants(request, [(pk, code) for pk, code, quantity in lines])
+        cart.total_weight = cart.compute_weight([(pk, quantity) for pk, code, quantity in lines], products)
+        return super(PrimaryCartModifier, self).pre_process_cart(cart, request, raise_exception)
+
+    def pre_process_cart_item(self, cart, cart_item, request, raise_exception=False):
+        cart_item.product = self.get_product(cart_item, request)
+        return super(PrimaryCartModifier, self).pre_process_cart_item(cart, cart_item, request, raise_exception)
+
+    def get_product(self, cart_item, request):
+        """
+        Return the product of the given cart item, as fetched by ``pre_process_cart``.
+        """
+        product = get_request_cache(request, 'cart_products').get(cart_item.product_id)
+        return cart_item.product if product is None else product
+
     def process_cart_item(self, cart_item, request):
-        variant = cart_item.product.get_product_variant(
-            product_code=cart_item.product_code)
+        product = self.get_product(cart_item, request)
+        variant = product.get_product_variant(product_code=cart_item.product_code, request=request)
         cart_item.unit_price = variant.unit_price
         cart_item.line_total = cart_item.unit_price * cart_item.quantity
-        try:
-            rebate = cart_item.product.get_rebate(cart_item.quantity)
+        get_rebate = getattr(product, 'get_rebate', None)
+        if get_rebate:
+            rebate = get_rebate(cart_item.quantity)
             cart_item.line_total = cart_item.line_total - (cart_item.line_total * rebate) / 100
             cart_item.unit_price = cart_item.unit_price - (cart_item.unit_price * rebate) / 100
-        except:
-            pass
         # grandparent super
         return super(DefaultCartModifier, self).process_cart_item(cart_item, request)
 
 
 class PostalShippingModifier(ShippingModifier):
     identifier = 'postal-shipping'
+    # weight bands in kg, used as long as no ShippingRate has been entered for this modifier
+    default_rates = (('0', '4'), ('1', '7.5'), ('3', '10'), ('15', '20'), ('30', '500'))
 
     def get_choice(self):
         return (self.identifier, _("Postal shipping"))
@@ -43,21 +77,8 @@ class PostalShippingModifier(ShippingModifier):
     def add_extra_cart_row(self, cart, request):
         if not self.is_active(cart.extra.get('shipping_modifier')) and len(cart_modifiers_pool.get_shipping_modifiers()) > 1:
             return
-        # add a shipping flat fee
-        amount = Money('5')
-        if cart.total_weight<1:
-            amount = Money('4')
-        elif cart.total_weight >=1 and cart.total_weight < 3:
-            amount = Money('7.5')
-        elif cart.total_weight >=3 and cart.total_weight < 15:
-            amount = Money('10')
-        elif cart.total_weight >=15 and cart.total_weight < 30:
-            amount = Money('20')
-        elif cart.total_weight > 30:
-            amount = Money('500')
-        else:
-            amount = Money('999')
-
+        # add the shipping costs for the weight band of this cart
+        amount = ShippingRate.objects.get_amount(self.identifier, cart.total_weight, self.default_rates)
         instance = {'label': _("Shipping costs"), 'amount': amount}
         cart.extra_rows[self.identifier] = ExtraCartRow(instance)
         cart.total += amount
@@ -69,6 +90,7 @@ class PostalShippingModifier(ShippingModifier):
 
 class CourierModifier(ShippingModifier):
     identifier = 'courier-delivery'
+    default_rates = (('0', '3'),)
 
     def get_choice(self):
         return (self.identifier, _("Courier delivery. Onliy within Minsk"))
@@ -76,8 +98,8 @@ class CourierModifier(ShippingModifier):
     def add_extra_cart_row(self, cart, request):
         if not self.is_active(cart.extra.get('shipping_modifier')) and len(cart_modifiers_pool.get_shipping_modifiers()) > 1:
             return
-        # add a shipping flat fee
-        amount = Money('3')
+        # add the shipping costs for the weight band of this cart
+        amount = ShippingRate.objects.get_amount(self.identifier, cart.total_weight, self.default_rates)
         instance = {'label': _("Courier shipping costs"), 'amount': amount}
         cart.extra_rows[self.identifier] = ExtraCartRow(instance)
         cart.total += amount
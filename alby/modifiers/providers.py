@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+from django.db import transaction
 from django.http.response import HttpResponseRedirect
 from shop.models.order import OrderModel, BaseOrder
 from django.core.exceptions import ImproperlyConfigured
 from shop.payment.providers import PaymentProvider
 import json
 from shop.models.defaults.order import Order
+from alby.tasks import notify_order
+
+
+def create_order(cart, request):
+    """
+    Create the order from the cart in one transaction. Rendering and queueing the notifications
+    of its initial status is left to the worker, once the order has been committed.
+    """
+    with transaction.atomic():
+        order = OrderModel.objects.create_from_cart(cart, request)
+        order.populate_from_cart(cart, request)
+        order.save()
+        notify_order.delay(order.pk, order.status)
+    return order
 
 
 class PayWhenTake(PaymentProvider):
@@ -22,9 +37,7 @@ class PayWhenTake(PaymentProvider):
     #     super(PayWhenTake, self).__init__()
 
     def get_payment_request(self, cart, request):
-        order = OrderModel.objects.create_from_cart(cart, request)
-        order.populate_from_cart(cart, request)
-        order.save(with_notification=True)
+        order = create_order(cart, request)
         return 'window.location.href="{}";'.format(order.get_absolute_url())
 
 class PayAtPostProvider(PaymentProvider):
@@ -41,7 +54,5 @@ class PayAtPostProvider(PaymentProvider):
     #     super(PayWhenTake, self).__init__()
 
     def get_payment_request(self, cart, request):
-        order = OrderModel.objects.create_from_cart(cart, request)
-        order.populate_from_cart(cart, request)
-        order.save(with_notification=True)
+        order = create_order(cart, request)
         return 'window.location.href="{}";'.format(order.get_absolute_url())
@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+"""
+Haystack backends to search without an Elasticsearch node.
+
+``SQLiteSearchEngine`` keeps the search documents inside a SQLite database file, using its
+FTS5 extension for the full text and autocomplete fields. ``FallbackSearchEngine`` writes into
+two backends and reads from the first one, switching to the second while the first is down.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+from haystack import connections
+from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
+from haystack.constants import DEFAULT_ALIAS, DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SkipDocument
+from haystack.inputs import Clean, PythonData
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+from haystack.utils.loading import import_class
+
+logger = logging.getLogger('alby')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    django_ct TEXT NOT NULL,
+    django_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_django_ct ON documents (django_ct);
+CREATE TABLE IF NOT EXISTS terms (
+    id TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS terms_field_value ON terms (field, value);
+CREATE INDEX IF NOT EXISTS terms_id ON terms (id);
+CREATE VIRTUAL TABLE IF NOT EXISTS fulltext USING fts5(
+    id UNINDEXED,
+    content,
+    prefix,
+    tokenize='unicode61 remove_diacritics 2',
+    prefix='2 3 4'
+);
+"""
+
+# full text columns for the document field and for the autocomplete fields
+CONTENT_COLUMN, PREFIX_COLUMN = 'content', 'prefix'
+NGRAM_FIELD_TYPES = ('edge_ngram', 'ngram')
+DOCUMENT_COLUMNS = (ID, DJANGO_CT, DJANGO_ID)
+
+
+def to_term(value):
+    """
+    Convert a prepared value into something SQLite compares the same way as the Python value.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (six.integer_types, float)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def quote(value):
+    value = to_term(value)
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (six.integer_types, float)):
+        return repr(value)
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def to_json(value):
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return to_term(value)
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    Store the search documents in a SQLite database file, given by the connection's ``PATH``.
+    Every thread of every process opens its own connection to that file.
+
+    ``PATH`` may be a symbolic link onto the database file, so that a rebuilt index can replace
+    the current one at once, see :meth:`create_replacement`. Connections are opened on the file
+    the link points to, and reopened once it points elsewhere.
+    """
+    def __init__(self, connection_alias, **connection_options):
+        super(SQLiteSearchBackend, self).__init__(connection_alias, **connection_options)
+        if not connection_options.get('PATH'):
+            raise ImproperlyConfigured("You must specify a 'PATH' in your settings for connection '{}'."
+                                       .format(connection_alias))
+        self.connection_options = connection_options
+        self.path = connection_options['PATH']
+        self._local = threading.local()
+
+    def get_connection(self):
+        # the journal files are named after the opened file, hence never shared by two indices
+        path = os.path.realpath(self.path)
+        if getattr(self._local, 'pid', None) != os.getpid() or self._local.path != path:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            connection = sqlite3.connect(path, timeout=self.timeout)
+            # readers in the web processes must not block the worker writing into the index
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self.close()
+            self._local.connection, self._local.pid, self._local.path = connection, os.getpid(), path
+        return self._local.connection
+
+    def close(self):
+        if getattr(self._local, 'pid', None) == os.getpid():
+            self._local.connection.close()
+        self._local.__dict__.clear()
+
+    def create_replacement(self):
+        """
+        Return a backend writing into a new, empty database file next to the current one. Once
+        filled, :meth:`replace_with` makes it the index of this backend.
+        """
+        root, ext = os.path.splitext(os.path.realpath(self.path))
+        # a replaced index may in turn be replaced, its timestamp is dropped then
+        root = re.sub(r'-\d{20}$', '', root)
+        path = '{}-{:%Y%m%d%H%M%S%f}{}'.format(root, datetime.datetime.now(), ext)
+        return self.__class__(self.connection_alias, **dict(self.connection_options, PATH=path))
+
+    def replace_with(self, replacement):
+        """
+        Point ``PATH`` onto the database file of ``replacement`` in one atomic rename, and
+        delete the previous file, which connections still open on it keep reading until they
+        notice the swap on their next query.
+        """
+        replacement.close()
+        previous = os.path.realpath(self.path) if os.path.lexists(self.path) else None
+        link = '{}.link'.format(self.path)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.relpath(replacement.path, os.path.dirname(self.path)), link)
+        os.replace(link, self.path)
+        if previous and previous != os.path.realpath(self.path):
+            # a plain database file at PATH has been replaced by the link already
+            names = [previous + '-wal', previous + '-shm']
+            if previous != self.path:
+                names.append(previous)
+            for name in names:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def get_term_fields(self, index):
+        """
+        Return the fields of ``index`` which can be filtered by value. Full text fields and
+        unindexed strings, such as rendered HTML snippets, are left out.
+        """
+        return [field for field in index.fields.values() if not field.document
+                and field.field_type not in NGRAM_FIELD_TYPES
+                and not (field.field_type == 'string' and not field.indexed)]
+
+    def update(self, index, iterable, commit=True):
+        content_fields = [field.index_fieldname for field in index.fields.values() if field.document]
+        prefix_fields = [field.index_fieldname for field in index.fields.values()
+                         if field.field_type in NGRAM_FIELD_TYPES]
+        stored_fields = [field.index_fieldname for field in index.fields.values() if field.stored]
+        term_fields = [field.index_fieldname for field in self.get_term_fields(index)]
+        connection = self.get_connection()
+        try:
+            with connection:
+                for obj in iterable:
+                    try:
+                        document = index.full_prepare(obj)
+                    except SkipDocument:
+                        continue
+                    identifier = document[ID]
+                    self._delete(connection, [identifier])
+                    data = dict((name, to_json(document.get(name))) for name in stored_fields)
+                    connection.execute('INSERT INTO documents VALUES (?, ?, ?, ?)', (
+                        identifier, document[DJANGO_CT], six.text_type(document[DJANGO_ID]), json.dumps(data)))
+                    connection.execute('INSERT INTO fulltext VALUES (?, ?, ?)', (
+                        identifier,
+                        ' '.join(six.text_type(document[name]) for name in content_fields if document.get(name)),
+                        ' '.join(six.text_type(document[name]) for name in prefix_fields if document.get(name)),
+                    ))
+                    terms = []
+                    for name in term_fields:
+                        values = document.get(name)
+                        if not isinstance(values, (list, tuple, set, frozenset)):
+                            values = [values]
+                        terms.extend((identifier, name, to_term(value)) for value in values if value is not None)
+                    connection.executemany('INSERT INTO terms VALUES (?, ?, ?)', terms)
+        except sqlite3.Error as e:
+            if not self.silently_fail:
+                raise
+            logger.error("Failed to add documents to SQLite search index: {}".format(e))
+
+    def _delete(self, connection, identifiers):
+        placeholders = ', '.join('?' * len(identifiers))
+        for table in ('documents', 'terms', 'fulltext'):
+            connection.execute('DELETE FROM {} WHERE id IN ({})'.format(table, placeholders), identifiers)
+
+    def remove(self, obj_or_string, commit=True):
+        connection = self.get_connection()
+        with connection:
+            self._delete(connection, [get_identifier(obj_or_string)])
+
+    def clear(self, models=None, commit=True):
+        connection = self.get_connection()
+        with connection:
+            if models is None:
+                for table in ('documents', 'terms', 'fulltext'):
+                    connection.execute('DELETE FROM {}'.format(table))
+            else:
+                model_cts = [get_model_ct(model) for model in models]
+                identifiers = [row[0] for row in connection.execute(
+                    'SELECT id FROM documents WHERE django_ct IN ({})'.format(', '.join('?' * len(model_cts))),
+                    model_cts)]
+                if identifiers:
+                    self._delete(connection, identifiers)
+
+    def get_model_cts(self, models=None, limit_to_registered_models=None):
+        if models:
+            return [get_model_ct(model) for model in models]
+        if limit_to_registered_models is None:
+            from django.conf import settings
+            limit_to_registered_models = getattr(settings, 'HAYSTACK_LIMIT_TO_REGISTERED_MODELS', True)
+        if limit_to_registered_models:
+            unified_index = connections[self.connection_alias].get_unified_index()
+            return [get_model_ct(model) for model in unified_index.get_indexed_models()]
+
+    @log_query
+    def search(self, query_string, sort_by=None, start_offset=0, end_offset=None, models=None,
+               limit_to_registered_models=None, result_class=None, rank_by=None, **kwargs):
+        if not query_string:
+            return {'results': [], 'hits': 0}
+        conditions = [query_string]
+        model_cts = self.get_model_cts(models, limit_to_registered_models)
+        if model_cts is not None:
+            conditions.append('django_ct IN ({})'.format(', '.join(quote(ct) for ct in model_cts) or 'NULL'))
+        where = ' AND '.join('({})'.format(condition) for condition in conditions)
+
+        if rank_by:
+            # bm25() returns smaller values for better matches
+            rank = ('(SELECT bm25(fulltext) FROM fulltext WHERE fulltext MATCH {} AND fulltext.id = documents.id)'
+                    .format(quote(rank_by)))
+        else:
+            rank = '0'
+        order_by = []
+        for field in sort_by or []:
+            direction = 'DESC' if field.startswith('-') else 'ASC'
+            field = field.lstrip('-')
+            column = field if field in DOCUMENT_COLUMNS else "json_extract(data, {})".format(quote('$.' + field))
+            order_by.append('{} {}'.format(column, direction))
+        order_by.extend(['rank', 'id'])
+
+        try:
+            connection = self.get_connection()
+            hits = connection.execute('SELECT COUNT(*) FROM documents WHERE {}'.format(where)).fetchone()[0]
+            limit = -1 if end_offset is None else max(end_offset - start_offset, 0)
+            rows = connection.execute(
+                'SELECT django_ct, django_id, data, {} AS rank FROM documents WHERE {} ORDER BY {} LIMIT ? OFFSET ?'
+                .format(rank, where, ', '.join(order_by)), (limit, start_offset)).fetchall()
+        except sqlite3.Error as e:
+            if not self.silently_fail:
+                raise
+            logger.error("Failed to query SQLite search index using '{}': {}".format(query_string, e))
+            return {'results': [], 'hits': 0}
+
+        result_class = result_class or SearchResult
+        results = []
+        for django_ct, django_id, data, rank in rows:
+            app_label, model_name = django_ct.split('.')
+            data = dict((str(key), value) for key, value in json.loads(data).items())
+            results.append(result_class(app_label, model_name, django_id, -(rank or 0), **data))
+        return {'results': results, 'hits': hits, 'facets': {}, 'spelling_suggestion': None}
+
+    def more_like_this(self, model_instance, additional_query_string=None, **kwargs):
+        return {'results': [], 'hits': 0}
+
+
+class SQLiteSearchQuery(BaseSearchQuery):
+    """
+    Build a SQL condition on the table ``documents``. Conditions on the document field and
+    on the autocomplete fields are delegated to the FTS5 table ``fulltext``, the remaining
+    ones to the table ``terms``.
+    """
+    lookups = {
+        'content': '= {}',
+        'exact': '= {}',
+        'fuzzy': '= {}',
+        'gt': '> {}',
+        'gte': '>= {}',
+        'lt': '< {}',
+        'lte': '<= {}',
+    }
+
+    def __init__(self, using=DEFAULT_ALIAS):
+        super(SQLiteSearchQuery, self).__init__(using=using)
+        self.match_expressions = []
+
+    def matching_all_fragment(self):
+        return '1'
+
+    def build_query(self):
+        self.match_expressions = []
+        return super(SQLiteSearchQuery, self).build_query()
+
+    def build_params(self, spelling_query=None):
+        kwargs = super(SQLiteSearchQuery, self).build_params(spelling_query=spelling_query)
+        if self.match_expressions:
+            kwargs['rank_by'] = ' OR '.join('({})'.format(expression) for expression in self.match_expressions)
+        return kwargs
+
+    def get_fulltext_column(self, field):
+        if field == 'content':
+            return CONTENT_COLUMN
+        unified_index = connections[self._using].get_unified_index()
+        search_field = unified_index.all_searchfields().get(unified_index.get_index_fieldname(field))
+        if search_field is None:
+            return None
+        if search_field.document:
+            return CONTENT_COLUMN
+        if search_field.field_type in NGRAM_FIELD_TYPES:
+            return PREFIX_COLUMN
+
+    def build_query_fragment(self, field, filter_type, value):
+        if not hasattr(value, 'input_type_name'):
+            if hasattr(value, 'values_list'):
+                value = list(value)
+            value = Clean(value) if isinstance(value, six.string_types) else PythonData(value)
+        value = value.prepare(self)
+
+        column = self.get_fulltext_column(field)
+        if column:
+            words = re.findall(r'\w+', six.text_type(value), re.UNICODE)
+            if not words:
+                return self.matching_all_fragment()
+            wildcard = '*' if column == PREFIX_COLUMN or filter_type in ('contains', 'startswith') else ''
+            expression = ' AND '.join('{} : "{}"{}'.format(column, word, wildcard) for word in words)
+            self.match_expressions.append(expression)
+            return 'id IN (SELECT id FROM fulltext WHERE fulltext MATCH {})'.format(quote(expression))
+
+        index_fieldname = connections[self._using].get_unified_index().get_index_fieldname(field)
+        if filter_type in self.lookups:
+            condition = self.lookups[filter_type].format(quote(value))
+        elif filter_type == 'in':
+            condition = 'IN ({})'.format(', '.join(quote(item) for item in value) or 'NULL')
+        elif filter_type == 'range':
+            condition = 'BETWEEN {} AND {}'.format(quote(value[0]), quote(value[1]))
+        elif filter_type in ('contains', 'startswith', 'endswith'):
+            pattern = six.text_type(value).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            pattern = {'contains': '%{}%', 'startswith': '{}%', 'endswith': '%{}'}[filter_type].format(pattern)
+            condition = "LIKE {} ESCAPE '\\'".format(quote(pattern))
+        else:
+            raise NotImplementedError("Filter '{}' is not supported by the SQLite search backend".format(filter_type))
+        if index_fieldname in DOCUMENT_COLUMNS:
+            return '{} {}'.format(index_fieldname, condition)
+        return 'id IN (SELECT id FROM terms WHERE field = {} AND value {})'.format(quote(index_fieldname), condition)
+
+
+class SQLiteSearchEngine(BaseEngine):
+    backend = SQLiteSearchBackend
+    query = SQLiteSearchQuery
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """
+    Write every document into the backends configured by ``PRIMARY`` and ``FALLBACK``, and
+    search through the primary one. Whenever the primary backend fails, searches are served by
+    the fallback backend during the next ``RETRY_AFTER`` seconds.
+    """
+    def __init__(self, connection_alias, **connection_options):
+        super(FallbackSearchBackend, self).__init__(connection_alias, **connection_options)
+        self.retry_after = connection_options.get('RETRY_AFTER', 30)
+        # errors of the primary backend must reach us, rather than turning into empty results
+        primary_options = dict(connection_options['PRIMARY'], SILENTLY_FAIL=False)
+        self.primary_engine = import_class(primary_options['ENGINE'])
+        self.primary = self.primary_engine.backend(connection_alias, **primary_options)
+        fallback_options = connection_options['FALLBACK']
+        self.fallback_engine = import_class(fallback_options['ENGINE'])
+        self.fallback = self.fallback_engine.backend(connection_alias, **fallback_options)
+        self.unavailable_until = 0
+
+    def is_primary_available(self):
+        return time.time() >= self.unavailable_until
+
+    def set_primary_unavailable(self, error):
+        logger.warning("Search backend unavailable, falling back for {} seconds: {}".format(self.retry_after, error))
+        self.unavailable_until = time.time() + self.retry_after
+
+    def write_primary(self, method, identifiers, *args, **kwargs):
+        """
+        Call ``method`` of the primary backend. If it is unavailable, the outage must not make
+        saving products fail: the affected documents are queued again, see
+        ``alby.search_signals.SearchQueue``, or else left to the nightly rebuild.
+        """
+        if self.is_primary_available():
+            try:
+                getattr(self.primary, method)(*args, **kwargs)
+                return
+            except Exception as e:
+                self.set_primary_unavailable(e)
+        from alby.search_signals import SearchQueue
+        from alby.system.redis import get_redis_connection
+
+        if identifiers and get_redis_connection() is not None:
+            try:
+                SearchQueue().push(*identifiers)
+            except Exception as e:
+                logger.warning("Failed to queue {} search documents: {}".format(len(identifiers), e))
+
+    def update(self, index, iterable, commit=True):
+        iterable = list(iterable)
+        self.fallback.update(index, iterable, commit=commit)
+        self.write_primary('update', [get_identifier(obj) for obj in iterable], index, iterable, commit=commit)
+
+    def remove(self, obj_or_string, commit=True):
+        self.fallback.remove(obj_or_string, commit=commit)
+        self.write_primary('remove', [get_identifier(obj_or_string)], obj_or_string, commit=commit)
+
+    def clear(self, models=None, commit=True):
+        self.fallback.clear(models=models, commit=commit)
+        self.write_primary('clear', [], models=models, commit=commit)
+
+    def search(self, query_string, **kwargs):
+        # raw queries are written in the syntax of the primary backend
+        return self.primary.search(query_string, **kwargs)
+
+    def more_like_this(self, model_instance, additional_query_string=None, **kwargs):
+        return self.primary.more_like_this(model_instance, additional_query_string, **kwargs)
+
+
+class FallbackSearchQuery(BaseSearchQuery):
+    """
+    Run the query through the query class of the primary backend, or of the fallback backend
+    if the primary one is unavailable.
+    """
+    def get_backend_query(self, engine, backend):
+        query = self._clone(klass=engine.query)
+        query.backend = backend
+        return query
+
+    def run_query(self, method, **kwargs):
+        backend = self.backend
+        query = None
+        if backend.is_primary_available():
+            query = self.get_backend_query(backend.primary_engine, backend.primary)
+            try:
+                getattr(query, method)(**kwargs)
+            except Exception as e:
+                backend.set_primary_unavailable(e)
+                query = None
+        if query is None:
+            query = self.get_backend_query(backend.fallback_engine, backend.fallback)
+            getattr(query, method)(**kwargs)
+        self._results = query._results
+        self._hit_count = query._hit_count
+        self._facet_counts = query._facet_counts
+        self._stats = query._stats
+        self._spelling_suggestion = query._spelling_suggestion
+
+    def run(self, spelling_query=None, **kwargs):
+        self.run_query('run', spelling_query=spelling_query, **kwargs)
+
+    def run_mlt(self, **kwargs):
+        self.run_query('run_mlt', **kwargs)
+
+    def build_query_fragment(self, field, filter_type, value):
+        return self.get_backend_query(self.backend.primary_engine, self.backend.primary).build_query_fragment(
+            field, filter_type, value)
+
+
+class FallbackSearchEngine(BaseEngine):
+    backend = FallbackSearchBackend
+    query = FallbackSearchQuery
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+from collections import defaultdict
+from django.apps import apps
+from django.db import models, transaction
+from haystack import connections
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+from alby.system.cache import bump_catalog_version
+from alby.system.redis import get_redis_connection
+
+logger = logging.getLogger('alby')
+
+
+class SearchQueue(object):
+    """
+    Set of products whose search documents are outdated, identified as ``app_label.model.pk``.
+    Being a set, a product saved many times before the queue is drained is indexed only once.
+    """
+    key = 'alby:search-queue'
+
+    def __init__(self, connection=None):
+        self.connection = connection
+
+    def get_connection(self):
+        if self.connection is None:
+            self.connection = get_redis_connection()
+        return self.connection
+
+    def push(self, *identifiers):
+        self.get_connection().sadd(self.key, *identifiers)
+
+    def pop(self, count):
+        return [identifier.decode('utf-8') if isinstance(identifier, bytes) else identifier
+                for identifier in self.get_connection().spop(self.key, count) or []]
+
+    def __len__(self):
+        return self.get_connection().scard(self.key)
+
+    def drain(self, batch_size=100):
+        """
+        Update the search documents of all queued products, ``batch_size`` at a time. A batch
+        which fails is pushed back onto the queue and draining stops until the next call, since
+        the search engine is likely unavailable. Return the number of processed products.
+        """
+        processed = 0
+        # products queued again meanwhile, e.g. by FallbackSearchBackend, wait for the next call
+        remaining = len(self)
+        while processed < remaining:
+            identifiers = self.pop(min(batch_size, remaining - processed))
+            if not identifiers:
+                return processed
+            try:
+                update_search_index(identifiers)
+            except Exception:
+                self.push(*identifiers)
+                logger.exception("Failed to update the search index, the products remain queued")
+                return processed
+            processed += len(identifiers)
+        return processed
+
+
+def get_identifier(model, pk):
+    return '{}.{}'.format(model._meta.label_lower, pk)
+
+
+def update_search_index(identifiers):
+    """
+    Update the search documents of the products given by their identifiers in every search
+    connection. Products which do not exist anymore or are not indexable are removed. Finally
+    the catalog version is bumped, since search responses cached meanwhile may be outdated.
+    """
+    pks_by_model = defaultdict(set)
+    for identifier in identifiers:
+        app_label, model_name, pk = identifier.split('.')
+        pks_by_model[apps.get_model(app_label, model_name)].add(pk)
+
+    for using in connections.connections_info:
+        unified_index = connections[using].get_unified_index()
+        backend = connections[using].get_backend()
+        for model, pks in pks_by_model.items():
+            try:
+                index = unified_index.get_index(model)
+            except NotHandled:
+                continue
+            products = list(index.index_queryset(using=using).filter(pk__in=pks))
+            if products:
+                backend.update(index, products)
+            for pk in pks - set(str(product.pk) for product in products):
+                backend.remove(get_identifier(model, pk))
+    bump_catalog_version()
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    """
+    Instead of updating the search index while saving a product, remember the product in the
+    :class:`SearchQueue`, which is drained by the worker using ``manage.py update_search_queue``.
+    Without Redis the search index is updated synchronously, after the transaction commits.
+    """
+    def setup(self):
+        models.signals.post_save.connect(self.enqueue)
+        models.signals.post_delete.connect(self.enqueue)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.enqueue)
+        models.signals.post_delete.disconnect(self.enqueue)
+
+    def is_indexed(self, model):
+        for using in self.connections.connections_info:
+            try:
+                self.connections[using].get_unified_index().get_index(model)
+            except NotHandled:
+                continue
+            return True
+        return False
+
+    def enqueue(self, sender, instance=None, raw=False, **kwargs):
+        if raw or not self.is_indexed(sender):
+            return
+        identifier = get_identifier(sender, instance.pk)
+        if get_redis_connection() is None:
+            transaction.on_commit(lambda: update_search_index([identifier]))
+        else:
+            transaction.on_commit(lambda: self.push(identifier))
+
+    def push(self, identifier):
+        try:
+            SearchQueue().push(identifier)
+        except Exception as exc:
+            logger.warning("Unable to queue {} for indexing: {}".format(identifier, exc))
@@ -1,3 +1,3 @@
 from .serializers import CatalogSearchSerializer, ProductSearchSerializer
-from .catalog import RebateAddToCartSerializer, AddSofaToCartSerializer, UpdateDataSerialiser
+from .catalog import RebateAddToCartSerializer, AddSofaToCartSerializer
 from .product_summary import ProductSummarySerializer
@@ -1,13 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from rest_framework.fields import empty
 from shop.models.cart import CartModel
 from shop.rest.money import MoneyField
 from shop.serializers.bases import AvailabilitySerializer
 from shop.serializers.defaults.catalog import AddToCartSerializer
-from alby.models import VariantImage
-from rest_framework import serializers
 from alby.models import Fabric, ProductList
 
 
@@ -53,13 +50,12 @@ class RebateAddToCartSerializer(AddToCartSerializer):
             }
             return instance
 
-        try:
-            rebate = product.get_rebate(data.get('quantity'))
+        get_rebate = getattr(product, 'get_rebate', None)
+        if get_rebate:
+            rebate = get_rebate(data.get('quantity'))
             price = unit_price * data.get('quantity')
             subtotal_price = price - (price * rebate) / 100
             unit_price = unit_price - (unit_price * rebate) / 100
-        except:
-            pass
 
         instance = {
             'product': product.id,
@@ -83,51 +79,22 @@ class AddSofaToCartSerializer(AddToCartSerializer):
         except CartModel.DoesNotExist:
             cart = None
         try:
-            variant = product.get_product_variant(product_code=data['product_code'])
+            variant = product.get_product_variant(product_code=data['product_code'], request=request)
         except (TypeError, KeyError, product.DoesNotExist):
             variant = product.variants.first()
-        try:
-            # TODO: change explicit model name no variant relation manager
-            imgvar = VariantImage.objects.filter(product_id=variant.id)
-            imglist = []
-            imglist += [[i.image.url, j.image.thumbnails['admin_directory_listing_icon']] for [i, j] in zip(imgvar, imgvar)]
-        except:
-            imglist = 'default_img'
+        imglist = variant.get_gallery()
 
         instance = {
             'product': product.id,
             'product_code': variant.product_code,
             'unit_price': variant.unit_price,
-            'is_in_cart': bool(product.is_in_cart(cart, product_code=variant.product_code)),
-            'extra': {'fabric': variant.fabric.fabric_name, 'img': imglist},
+            'is_in_cart': product.has_in_cart(cart, str(variant.product_code), request),
+            'extra': {
+                'fabric': variant.fabric.fabric_name,
+                'img': imglist,
+                'cart_codes': product.get_codes_in_cart(cart, request),
+            },
             'availability': product.get_availability(request),
 
         }
         return instance
-
-class UpdateDataSerialiser(serializers.Serializer):
-    """
-    Modified AddToCartSerializer which handles Sofas
-    """
-    fabric_name = serializers.CharField(read_only=True, help_text="Exact product code of the cart item")
-    fabric_type = serializers.CharField(read_only=True, help_text="Exact product code of the cart item")
-    composition = serializers.CharField(read_only=True, help_text="Exact product code of the cart item")
-    care = serializers.CharField(read_only=True, help_text="Exact product code of the cart item")
-    description = serializers.CharField(read_only=True, help_text="Exact product code of the cart item")
-
-    def __init__(self, instance=None, data=empty, **kwargs):
-        context = kwargs.get('context', {})
-        instance = self.get_instance(context, data, kwargs)
-        super(UpdateDataSerialiser, self).__init__(instance, data, context=context)
-
-    def get_instance(self, context, data, extra_args):
-
-        product = context['product']
-        request = context['request']
-        return {
-            'fabric_name': product.product_name,
-            'fabric_type': product.fabric_type,
-            'composition': product.composition,
-            'description': product.description,
-            'care': product.care,
-        }
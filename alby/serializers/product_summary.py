@@ -1,8 +1,28 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from django.core.cache import cache
+from django.template import TemplateDoesNotExist
+from django.template.loader import select_template
+from django.utils.html import strip_spaces_between_tags
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language_from_request
 from rest_framework import serializers
+from shop.conf import app_settings
 from shop.serializers.bases import ProductSerializer
+from alby.system.cache import get_request_cache
+
+
+class ProductSummaryListSerializer(serializers.ListSerializer):
+    """
+    Fetch the rendered media snippets of all products in the list with one cache round trip,
+    before serializing them one by one.
+    """
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, 'all') else data)
+        if 'media' in self.child.fields:
+            self.child.prefetch_html(products, 'media')
+        return super(ProductSummaryListSerializer, self).to_representation(products)
 
 
 class ProductSummarySerializer(ProductSerializer):
@@ -18,6 +38,59 @@ class ProductSummarySerializer(ProductSerializer):
 
     class Meta(ProductSerializer.Meta):
         fields = ['id', 'product_name', 'product_url', 'product_model', 'price', 'media']
+        list_serializer_class = ProductSummaryListSerializer
 
     def get_media(self, product):
         return self.render_html(product, 'media')
+
+    def get_html_cache_key(self, product, postfix):
+        """
+        The key starts with ``product:<id>|``, so that ``InvalidateProductCacheMixin`` drops it
+        together with the other snippets of that product. Since it contains the modification
+        date, snippets of products changed outside the admin are rendered again.
+        """
+        return 'product:{0}|{1}-{2}-{3}-{4:%Y%m%d%H%M%S%f}'.format(product.id, self.label, postfix,
+            get_language_from_request(self.context['request']), product.updated_at)
+
+    def render_html(self, product, postfix):
+        fragments = get_request_cache(self.context['request'], 'product_html')
+        cache_key = self.get_html_cache_key(product, postfix)
+        if cache_key not in fragments:
+            self.prefetch_html([product], postfix)
+        return mark_safe(fragments[cache_key])
+
+    def prefetch_html(self, products, postfix):
+        """
+        Look up the HTML snippets of all given products with one ``get_many`` and render those
+        missing in the cache, storing them with one ``set_many``.
+        """
+        fragments = get_request_cache(self.context['request'], 'product_html')
+        keys = dict((self.get_html_cache_key(product, postfix), product) for product in products)
+        fragments.update(cache.get_many([key for key in keys if key not in fragments]))
+        rendered = {}
+        for key, product in keys.items():
+            if key not in fragments:
+                rendered[key] = self.render_snippet(product, postfix)
+        if rendered:
+            cache.set_many(rendered, app_settings.CACHE_DURATIONS['product_html_snippet'])
+            fragments.update(rendered)
+
+    def render_snippet(self, product, postfix):
+        """
+        Render the HTML snippet as ``ProductSerializer.render_html`` does, but without storing
+        it in shop's own cache, since the snippets are cached by :meth:`prefetch_html`.
+        """
+        app_label = product._meta.app_label.lower()
+        request = self.context['request']
+        params = [
+            (app_label, self.label, product.product_model, postfix),
+            (app_label, self.label, 'product', postfix),
+            ('shop', self.label, product.product_model, postfix),
+            ('shop', self.label, 'product', postfix),
+        ]
+        try:
+            template = select_template(['{0}/products/{1}-{2}-{3}.html'.format(*p) for p in params])
+        except TemplateDoesNotExist:
+            return "<!-- no such template: '{0}/products/{1}-{2}-{3}.html' -->".format(*params[0])
+        context = {'product': product, 'ABSOLUTE_BASE_URI': request.build_absolute_uri('/').rstrip('/')}
+        return strip_spaces_between_tags(template.render(context, request).strip())
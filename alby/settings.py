@@ -19,8 +19,13 @@ from django.utils.text import format_lazy
 from django.utils.translation import ugettext_lazy as _
 from cmsplugin_cascade.bootstrap4.mixins import BootstrapUtilities
 from cmsplugin_cascade.extra_fields.config import PluginExtraFieldsConfig
-from .private import admin_cred, DATABASES as DB
-from .private import PHONE_VERIFICATION as PV
+try:
+    from .private import admin_cred, DATABASES as DB
+    from .private import PHONE_VERIFICATION as PV
+except ImportError:
+    # the credentials are kept out of the repository, the tests run without them, see
+    # alby/tests/settings.py
+    admin_cred, DB, PV = [], {}, {}
 
 SHOP_APP_LABEL = 'alby'
 BASE_DIR = os.path.dirname(__file__)
@@ -523,6 +528,7 @@ CMSPLUGIN_CASCADE = {
         'CustomSnippetPlugin': [
             ('shop/catalog/product-heading.html', _("Product Heading")),
             # ('alby/catalog/manufacturer-filter.html', _("Manufacturer Filter")),
+            ('alby/catalog/facet-filter.html', _("Facet Filter")),
         ],
         # required to purchase real estate
         'ShopAddToCartPlugin': [
@@ -621,6 +627,10 @@ SELECT2_I18N_PATH = 'node_modules/select2/dist/js/i18n'
 
 ELASTICSEARCH_HOST = os.getenv('ELASTICSEARCH_HOST', 'localhost')
 
+# set SEARCH_BACKEND=sqlite to run without Elasticsearch, otherwise the SQLite index only
+# answers while Elasticsearch is unreachable
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'elasticsearch')
+
 HAYSTACK_CONNECTIONS = {
     # 'en': {
     #     'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
@@ -628,16 +638,29 @@ HAYSTACK_CONNECTIONS = {
     #     'INDEX_NAME': 'alby-en',
     # },
     'default': {
-        'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
-        'URL': 'http://{}:9200/'.format(ELASTICSEARCH_HOST),
-        'INDEX_NAME': 'alby-ru',
+        'ENGINE': 'alby.search_backends.FallbackSearchEngine',
+        'PRIMARY': {
+            'ENGINE': 'haystack.backends.elasticsearch_backend.ElasticsearchSearchEngine',
+            'URL': 'http://{}:9200/'.format(ELASTICSEARCH_HOST),
+            'INDEX_NAME': 'alby-ru',
+        },
+        'FALLBACK': {
+            'ENGINE': 'alby.search_backends.SQLiteSearchEngine',
+            'PATH': os.path.join(WORK_DIR, 'search', 'alby-ru.sqlite3'),
+        },
     },
 }
 
+if SEARCH_BACKEND == 'sqlite':
+    HAYSTACK_CONNECTIONS['default'] = HAYSTACK_CONNECTIONS['default']['FALLBACK']
+
 HAYSTACK_ROUTERS = [
     'shop.search.routers.LanguageRouter',
 ]
 
+# changed products are queued and indexed by the worker, see `alby.search_signals`
+HAYSTACK_SIGNAL_PROCESSOR = 'alby.search_signals.QueuedSignalProcessor'
+
 
 ############################################
 # settings for django-shop and its plugins
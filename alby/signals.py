@@ -1,14 +1,94 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from django.conf import settings
-from .models import ProductList, SofaVariant
-import os.path
-
-
-@receiver(pre_save)
-def save_scu(sender, instance=None, created=False, **kwargs):
-    list_of_models = ('SofaVariant', 'Product', 'Commodity', 'Lamel', 'Fabric')
-    if sender.__name__ in list_of_models: # this is the dynamic part you want
-        a = instance.id
-        saved_obj = ProductList.objects.create(product_model=sender.__name__)
-        instance.product_code_id = saved_obj.id
+from .models import ProductList, SofaModel, SofaVariant, Commodity, Lamel, Fabric, Discount, ShippingRate, VariantImage
+from .system import cache
+from . import tasks
+
+# models referring to ProductList through their field ``product_code``
+PRODUCT_CODE_MODELS = (SofaVariant, Commodity, Lamel, Fabric)
+
+
+@receiver(pre_save, sender=SofaVariant)
+@receiver(pre_save, sender=Commodity)
+@receiver(pre_save, sender=Lamel)
+@receiver(pre_save, sender=Fabric)
+def save_scu(sender, instance=None, raw=False, **kwargs):
+    """
+    Assign a new product code to products and variants when they are created. Instances with a
+    pre-assigned code, see ``ProductList.objects.assign()``, and fixtures are left untouched.
+    """
+    if raw or not instance._state.adding or instance.product_code_id:
+        return
+    saved_obj = ProductList.objects.create(product_model=sender.__name__)
+    instance.product_code_id = saved_obj.id
+
+
+@receiver(post_delete, sender=Discount)
+def invalidate_discount_tiers(sender, instance=None, **kwargs):
+    Discount.invalidate_tiers(instance.pk)
+
+
+@receiver(pre_save, sender=SofaVariant)
+def remember_sofa(sender, instance=None, raw=False, **kwargs):
+    """
+    Remember the sofa a variant belonged to, in case it is moved to another one.
+    """
+    if not raw and instance.pk:
+        instance._previous_product_model_id = sender.objects.filter(pk=instance.pk).values_list(
+            'product_model_id', flat=True).first()
+
+
+@receiver(post_save, sender=SofaVariant)
+@receiver(post_delete, sender=SofaVariant)
+def update_sofa_price_from(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        sofa_ids = {instance.product_model_id, getattr(instance, '_previous_product_model_id', None)}
+        sofa_ids.discard(None)
+        for sofa in SofaModel.objects.filter(pk__in=sofa_ids):
+            sofa.update_price_from()
+        SofaModel.invalidate_variant_matrix(sofa_ids)
+
+
+@receiver(post_save, sender=ShippingRate)
+@receiver(post_delete, sender=ShippingRate)
+def invalidate_shipping_rates(sender, **kwargs):
+    ShippingRate.objects.invalidate()
+
+
+@receiver(post_save, sender=VariantImage)
+@receiver(post_delete, sender=VariantImage)
+def update_variant_gallery(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        # generating thumbnails is left to the worker
+        tasks.update_variant_gallery.delay(instance.product_id)
+
+
+@receiver(post_save, sender=Fabric)
+def invalidate_fabric_variant_matrices(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        SofaModel.invalidate_variant_matrix(
+            SofaVariant.objects.filter(fabric=instance).values_list('product_model_id', flat=True))
+
+
+@receiver(post_save, sender=Fabric)
+@receiver(post_delete, sender=Fabric)
+def invalidate_fabric_details(sender, instance=None, raw=False, **kwargs):
+    if not raw:
+        instance.invalidate_details()
+
+
+@receiver(post_save, sender=Commodity)
+@receiver(post_save, sender=Lamel)
+@receiver(post_save, sender=Fabric)
+@receiver(post_save, sender=SofaModel)
+@receiver(post_save, sender=SofaVariant)
+@receiver(post_delete, sender=Commodity)
+@receiver(post_delete, sender=Lamel)
+@receiver(post_delete, sender=Fabric)
+@receiver(post_delete, sender=SofaModel)
+@receiver(post_delete, sender=SofaVariant)
+def bump_catalog_version(sender, **kwargs):
+    """
+    Outdate the facet index and everything else derived from the catalog version.
+    """
+    cache.bump_catalog_version()
@@ -20,7 +20,7 @@ djangoShopModule.controller('ModalInstanceCtrl',
 
 // Directive <ANY shop-add-to-cart="REST-API-endpoint">
 // handle dialog box on the product's detail page to add a product to the cart or watch-list
-djangoShopModule.directive('shopAddToCart', ['$http', '$log', function($http, $log) {
+djangoShopModule.directive('shopAddToCart', ['$http', '$log', '$q', '$timeout', function($http, $log, $q, $timeout) {
 	return {
 		controller: angular.noop,
 		restrict: 'EA',
@@ -36,7 +36,74 @@ djangoShopModule.directive('shopAddToCart', ['$http', '$log', function($http, $l
 			}).catch(function(ressponse) {
 				$log.error('Unable to get context: ' + ressponse.statusText);
 			});
+			// load all variants of a product, to switch between them without asking the server
+			scope.loadVariantMatrix = function(url) {
+				$http.get(url).then(function(response) {
+					scope.variantMatrix = {};
+					angular.forEach(response.data.variants, function(variant) {
+						scope.variantMatrix[variant.product_code] = variant;
+					});
+				}).catch(function(response) {
+					$log.error('Unable to load variant matrix: ' + response.statusText);
+				});
+			};
+			scope.switchVariant = function(variant) {
+				var cartCodes = scope.context.extra.cart_codes || [];
+				if (scope.context.is_in_cart && cartCodes.indexOf(scope.context.product_code) < 0) {
+					cartCodes.push(scope.context.product_code);
+				}
+				scope.dataLoaded = false;
+				scope.context.product_code = variant.product_code;
+				scope.context.unit_price = variant.unit_price;
+				scope.context.subtotal = variant.unit_price;
+				scope.context.is_in_cart = cartCodes.indexOf(variant.product_code) >= 0;
+				scope.context.extra.fabric = variant.fabric;
+				scope.context.extra.img = variant.img;
+				scope.context.extra.cart_codes = cartCodes;
+				$timeout(function() {
+					scope.dataLoaded = true;
+				});
+			};
+			// load the unit price per quantity tier, to price any quantity without asking the server
+			scope.loadPriceCurve = function(url) {
+				$http.get(url).then(function(response) {
+					scope.priceCurve = response.data;
+				}).catch(function(response) {
+					$log.error('Unable to load price curve: ' + response.statusText);
+				});
+			};
+			// the curve holds plain decimals, format them as the server formats money
+			scope.formatAmount = function(amount) {
+				var language = document.documentElement.lang || undefined;
+				return amount.toLocaleString(language, {minimumFractionDigits: 2, maximumFractionDigits: 2});
+			};
+			scope.applyPriceCurve = function() {
+				var quantity = parseInt(scope.context.quantity), tier = null, cents, subtotal, rounded;
+				if (!(quantity > 0))
+					return;
+				angular.forEach(scope.priceCurve.tiers, function(candidate) {
+					if (quantity >= candidate.quantity) tier = candidate;
+				});
+				if (!tier)
+					return;
+				// as the server does: price * quantity - rebate, rounded half to even onto cents
+				cents = Math.round(parseFloat(scope.priceCurve.unit_price) * 100);
+				subtotal = cents * quantity * (100 - tier.rebate) / 100;
+				rounded = Math.round(subtotal);
+				if (Math.abs(subtotal % 1) === 0.5 && rounded % 2)
+					rounded -= 1;
+				scope.context.unit_price = scope.formatAmount(parseFloat(tier.unit_price));
+				scope.context.subtotal = scope.formatAmount(rounded / 100);
+			};
 			scope.updateContext = function(test) {
+				if (test && scope.variantMatrix && scope.variantMatrix[test]) {
+					scope.switchVariant(scope.variantMatrix[test]);
+					return;
+				}
+				if (!test && scope.priceCurve && scope.priceCurve.tiers) {
+					scope.applyPriceCurve();
+					return;
+				}
 				if (test) scope.context.product_code = test;
 				scope.dataLoaded = false;
 				$http.post(attrs.shopAddToCart, scope.context).then(function(response) {
@@ -46,14 +113,24 @@ djangoShopModule.directive('shopAddToCart', ['$http', '$log', function($http, $l
 					$log.error('Unable to update context: ' + response.statusText);
 				});
 			};
-			scope.updateData = function(url, data) {
-
-				var str = "{product_code:'"+data+"'}";
-				scope.dataSmall = JSON.stringify(eval('('+str+')'));
-				$http.post(url, scope.dataSmall).then(function(response) {
-					scope.dataSmall = response.data;
+			// fetch the details of many fabrics at once and keep them for the fabric info dialog
+			scope.fabricDetails = {};
+			scope.loadFabricDetails = function(url, productCodes) {
+				var missing = productCodes.filter(function(code) {
+					return !scope.fabricDetails[code];
+				});
+				if (!missing.length)
+					return $q.resolve(scope.fabricDetails);
+				return $http.get(url, {params: {product_code: missing.join(',')}, cache: true}).then(function(response) {
+					angular.extend(scope.fabricDetails, response.data);
+					return scope.fabricDetails;
 				}).catch(function(response) {
-					$log.error('Unable to update data small: ' + response.statusText);
+					$log.error('Unable to load fabric details: ' + response.statusText);
+				});
+			};
+			scope.updateData = function(url, productCode) {
+				scope.loadFabricDetails(url, [productCode]).then(function() {
+					scope.dataSmall = scope.fabricDetails[productCode];
 				});
 			};
 		}
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+from django.core.cache import cache
+
+
+def get_request_cache(request, name):
+    """
+    Return a dictionary which lives as long as the given request, to memoize lookups repeated
+    during the same request. Without a request, a throw-away dictionary is returned.
+    """
+    if request is None:
+        return {}
+    # share the cache between a DRF Request and the wrapped HttpRequest
+    request = getattr(request, '_request', request)
+    return request.__dict__.setdefault('_alby_cache_{}'.format(name), {})
+
+
+CATALOG_VERSION_KEY = 'alby:catalog-version'
+
+
+def get_shared_version(key):
+    """
+    Return the counter stored in the cache under ``key``, which is shared by all processes, to
+    detect outdated per-process data.
+    """
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_shared_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the counter has been evicted, restarting it with a random value keeps it unique
+        cache.set(key, random.randint(2, 2 ** 30), None)
+
+
+def get_catalog_version():
+    """
+    Return a counter which changes whenever a product of the catalog is saved or deleted, to
+    derive cache keys and to detect outdated per-process data.
+    """
+    return get_shared_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_shared_version(CATALOG_VERSION_KEY)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Locks ensuring that a job scheduled on several worker replicas runs on only one of them.
+
+The schedule of each replica fires on its own clock. Hence every run of a job is identified
+by its slot, the number of the period it has been scheduled in, and the replica claiming a
+slot first runs it, while the others skip it. While a job runs, it additionally holds a lock,
+so that a run outlasting its period does not overlap with the run of the next slot.
+
+Locks are leases, expiring after ``ttl`` seconds unless their holder keeps renewing them. They
+are kept in Redis, or without Redis on the row of :class:`alby.models.ScheduledRun` named after
+the job, which also holds the latest claimed slot. Since a holder which stalls may lose its
+lease to another replica without noticing, each lease carries a fencing token, increasing with
+every acquisition. Jobs call :func:`fence` in the transaction committing their results, which
+fails once a later holder has done so.
+"""
+from __future__ import unicode_literals
+
+import datetime
+import logging
+import threading
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Q
+from django.utils import timezone
+from alby.system.redis import get_redis_connection
+
+logger = logging.getLogger('alby')
+
+_held = threading.local()
+
+
+class LockLost(Exception):
+    """
+    The lease on a lock has been lost, another holder may be doing the same work.
+    """
+
+
+class Lease(object):
+    """
+    Lease on the lock ``name``, renewed by a background thread every third of its ``ttl`` as
+    long as it is held. Subclasses store it.
+    """
+    def __init__(self, name, ttl=60):
+        self.name = name
+        self.ttl = ttl
+        self.token = None
+        self.lost = False
+        self._stopped = threading.Event()
+        self._renewer = None
+
+    def acquire(self):
+        self.token = self.take()
+        if self.token is None:
+            return False
+        self._renewer = threading.Thread(target=self.renew, name='renew-{}'.format(self.name), daemon=True)
+        self._renewer.start()
+        return True
+
+    def renew(self):
+        try:
+            while not self._stopped.wait(self.ttl / 3.0):
+                try:
+                    renewed = self.extend()
+                except Exception as exc:
+                    logger.warning("Failed to renew lock '{}': {}".format(self.name, exc))
+                    continue
+                if not renewed:
+                    self.lost = True
+                    logger.error("Lost lock '{}', the job may run on another node too".format(self.name))
+                    return
+        finally:
+            self.close()
+
+    def release(self):
+        self._stopped.set()
+        if self._renewer:
+            self._renewer.join()
+        self.drop()
+
+    def take(self):
+        """
+        Store the lease, unless it is held by someone else. Return its fencing token or ``None``.
+        """
+        raise NotImplementedError
+
+    def extend(self):
+        """
+        Extend the lease by ``ttl``. Return ``False`` if it has expired or been taken over.
+        """
+        raise NotImplementedError
+
+    def drop(self):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Free the resources used by the renewing thread.
+        """
+
+
+class RedisLease(Lease):
+    """
+    Lease on the key ``alby:lock:<name>``, holding its fencing token, which is drawn from the
+    counter ``alby:lock-token:<name>``.
+    """
+    extend_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    drop_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis_connection, name, ttl=60):
+        super(RedisLease, self).__init__(name, ttl)
+        self.connection = redis_connection
+        self.key = 'alby:lock:{}'.format(name)
+
+    def take(self):
+        if self.connection.exists(self.key):
+            return None
+        token = self.connection.incr('alby:lock-token:{}'.format(self.name))
+        if not self.connection.set(self.key, token, nx=True, px=int(self.ttl * 1000)):
+            return None
+        return token
+
+    def extend(self):
+        return self.connection.eval(self.extend_script, 1, self.key, self.token, int(self.ttl * 1000))
+
+    def drop(self):
+        self.connection.eval(self.drop_script, 1, self.key, self.token)
+
+
+class DatabaseLease(Lease):
+    """
+    Lease on the row of ``ScheduledRun`` named after the lock, valid until ``locked_until``.
+    Unlike file or advisory locks, it works with every database and across hosts.
+    """
+    def get_queryset(self):
+        from alby.models import ScheduledRun
+
+        return ScheduledRun.objects.filter(name=self.name)
+
+    def take(self):
+        from alby.models import ScheduledRun
+
+        ScheduledRun.objects.get_or_create(name=self.name)
+        now = timezone.now()
+        with transaction.atomic():
+            # the conditional UPDATE locks the row, hence the token read afterwards is ours
+            if not self.get_queryset().filter(Q(locked_until=None) | Q(locked_until__lte=now)).update(
+                    locked_until=now + datetime.timedelta(seconds=self.ttl), token=F('token') + 1):
+                return None
+            return self.get_queryset().values_list('token', flat=True).get()
+
+    def extend(self):
+        return self.get_queryset().filter(token=self.token, locked_until__gt=timezone.now()).update(
+            locked_until=timezone.now() + datetime.timedelta(seconds=self.ttl))
+
+    def drop(self):
+        self.get_queryset().filter(token=self.token).update(locked_until=None)
+
+    def close(self):
+        # the renewing thread has a database connection of its own
+        connection.close()
+
+
+def get_lock(name, ttl=60):
+    redis_connection = get_redis_connection()
+    if redis_connection is None:
+        return DatabaseLease(name, ttl)
+    return RedisLease(redis_connection, name, ttl)
+
+
+def fence(name):
+    """
+    Call inside the transaction committing the results of the job ``name``. Raise
+    :class:`LockLost` if the lease of this thread has been lost, or a later holder of the lock
+    has committed results meanwhile. Does nothing if the job does not run through
+    :func:`run_exclusively`, e.g. when its command is called by hand.
+    """
+    lock = getattr(_held, 'locks', {}).get(name)
+    if lock is None:
+        return
+    from alby.models import ScheduledRun
+
+    if lock.lost:
+        raise LockLost("Lost lock '{}'".format(name))
+    ScheduledRun.objects.get_or_create(name=name)
+    # the UPDATE locks the row until the transaction ends, hence holders commit one at a time
+    if not ScheduledRun.objects.filter(name=name, fencing_token__lte=lock.token).update(fencing_token=lock.token):
+        raise LockLost("Lock '{}' has been taken over, token {} is outdated".format(name, lock.token))
+
+
+CLAIM_SLOT_SCRIPT = """
+    local latest = tonumber(redis.call('get', KEYS[1]) or '-1')
+    if latest < tonumber(ARGV[1]) then
+        redis.call('set', KEYS[1], ARGV[1])
+        return 1
+    end
+    return 0
+"""
+
+
+def claim_slot(name, slot):
+    """
+    Claim the slot ``slot`` of the job ``name``. Return ``False`` if this or a later slot has
+    been claimed already.
+    """
+    from alby.models import ScheduledRun
+
+    redis_connection = get_redis_connection()
+    if redis_connection is not None:
+        return bool(redis_connection.eval(CLAIM_SLOT_SCRIPT, 1, 'alby:job-slot:{}'.format(name), slot))
+    # a conditional UPDATE is atomic, concurrent claims of the same slot update one row at most
+    if ScheduledRun.objects.filter(name=name, slot__lt=slot).update(slot=slot):
+        return True
+    try:
+        with transaction.atomic():
+            ScheduledRun.objects.create(name=name, slot=slot)
+    except IntegrityError:
+        # the row exists already and holds this or a later slot
+        return False
+    return True
+
+
+def run_exclusively(name, slot, func, *args, **kwargs):
+    """
+    Call ``func`` with the given arguments, unless the job ``name`` is running on another node,
+    or its slot ``slot`` has been run already. Then the call is skipped and ``None`` returned.
+    Without slot, only the lock is taken.
+    """
+    lock = get_lock(name)
+    if not lock.acquire():
+        logger.info("Skipped '{}', it is running on another node".format(name))
+        return None
+    if not hasattr(_held, 'locks'):
+        _held.locks = {}
+    _held.locks[name] = lock
+    try:
+        if slot is not None and not claim_slot(name, slot):
+            logger.debug("Skipped '{}', slot {} has been run on another node".format(name, slot))
+            return None
+        return func(*args, **kwargs)
+    finally:
+        _held.locks.pop(name, None)
+        try:
+            lock.release()
+        except Exception:
+            logger.exception("Failed to release lock '{}'".format(name))
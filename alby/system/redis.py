@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+
+_connection_pool = None
+_blocking_connection_pool = None
+
+
+def get_redis_connection():
+    """
+    Return a Redis client connected to the server configured in ``settings.SESSION_REDIS``, or
+    ``None`` if this installation runs without Redis.
+    """
+    global _connection_pool
+
+    if not hasattr(settings, 'SESSION_REDIS'):
+        return None
+    import redis
+
+    if _connection_pool is None:
+        redis_con = dict((key, settings.SESSION_REDIS[key]) for key in ['host', 'port', 'db', 'socket_timeout'])
+        _connection_pool = redis.ConnectionPool(**redis_con)
+    return redis.Redis(connection_pool=_connection_pool)
+
+
+def get_blocking_redis_connection():
+    """
+    Return a Redis client without socket timeout, for commands blocking until data arrives,
+    such as listening to a channel or reading from a stream, or ``None`` without Redis.
+    """
+    global _blocking_connection_pool
+
+    if not hasattr(settings, 'SESSION_REDIS'):
+        return None
+    import redis
+
+    if _blocking_connection_pool is None:
+        redis_con = dict((key, settings.SESSION_REDIS[key]) for key in ['host', 'port', 'db'])
+        _blocking_connection_pool = redis.ConnectionPool(**redis_con)
+    return redis.Redis(connection_pool=_blocking_connection_pool)
@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Queue of tasks, which request handlers hand over to the worker instead of doing the work
+themselves.
+
+A task is a function decorated with :func:`task`, queued by calling its ``delay`` method with
+JSON serializable arguments. With Redis, tasks are appended to a stream, which the worker reads
+as member of a consumer group: a task remains pending until it has been acknowledged, tasks
+of a crashed consumer are claimed by another one, while the claims of running tasks are renewed,
+and failing tasks are retried a few times before being moved onto a stream of failed tasks.
+Without Redis, tasks are run right away.
+"""
+from __future__ import unicode_literals
+
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict, deque
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from alby.system.redis import get_redis_connection
+
+logger = logging.getLogger('alby')
+
+
+def task(func):
+    """
+    Declare ``func`` as task, which then can be queued with ``func.delay(*args, **kwargs)``.
+    """
+    func.task_name = '{}.{}'.format(func.__module__, func.__name__)
+    func.delay = lambda *args, **kwargs: get_task_queue().enqueue(func.task_name, *args, **kwargs)
+    return func
+
+
+def get_task(name):
+    func = import_string(name)
+    if getattr(func, 'task_name', None) != name:
+        raise ValueError("{} is not a task".format(name))
+    return func
+
+
+def execute_task(name, args, kwargs):
+    """
+    Run the task ``name``. Runs inside a process of the worker's pool, which, unlike a request,
+    does not close its database connections, hence this is done before and after each task.
+    """
+    func = get_task(name)
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class Message(object):
+    def __init__(self, message_id, name, args, kwargs, attempt=0):
+        self.message_id = message_id
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.attempt = attempt
+
+    def __repr__(self):
+        return '<Message {} {} attempt {}>'.format(self.message_id, self.name, self.attempt)
+
+
+class RedisStreamBackend(object):
+    """
+    Tasks stored as entries of the stream ``alby:tasks``.
+    """
+    stream = 'alby:tasks'
+    failed_stream = 'alby:tasks:failed'
+    group = 'workers'
+    claim_after = 300  # seconds a delivered task may remain unacknowledged without being touched
+    max_failed = 10000
+
+    def __init__(self, connection, consumer=None):
+        self.connection = connection
+        self.consumer = consumer or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self._group_created = False
+
+    def ensure_group(self):
+        import redis
+
+        if self._group_created:
+            return
+        try:
+            self.connection.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except redis.ResponseError as exc:
+            if 'BUSYGROUP' not in str(exc):
+                raise
+        self._group_created = True
+
+    def push(self, name, args, kwargs, attempt=0):
+        payload = json.dumps({'args': args, 'kwargs': kwargs})
+        return self.connection.xadd(self.stream, {'task': name, 'payload': payload, 'attempt': attempt})
+
+    def to_message(self, message_id, fields):
+        fields = dict((key.decode('utf-8'), value.decode('utf-8')) for key, value in fields.items())
+        payload = json.loads(fields['payload'])
+        message_id = message_id.decode('utf-8') if isinstance(message_id, bytes) else message_id
+        return Message(message_id, fields['task'], payload['args'], payload['kwargs'], int(fields['attempt']))
+
+    def fetch(self, count, timeout=None):
+        """
+        Return up to ``count`` tasks, first those abandoned by other consumers, then new ones.
+        If there are none, block for at most ``timeout`` seconds, or not at all if not given.
+        """
+        self.ensure_group()
+        entries = []
+        pending = self.connection.xpending_range(self.stream, self.group, '-', '+', count)
+        stale = [p['message_id'] for p in pending if p['time_since_delivered'] >= self.claim_after * 1000]
+        if stale:
+            entries.extend(self.connection.xclaim(
+                self.stream, self.group, self.consumer, self.claim_after * 1000, stale))
+        if not entries:
+            # Redis would block forever on 0
+            block = int(timeout * 1000) if timeout else None
+            for stream, stream_entries in self.connection.xreadgroup(
+                    self.group, self.consumer, {self.stream: '>'}, count=count, block=block) or []:
+                entries.extend(stream_entries)
+        # claimed entries may have been deleted meanwhile
+        deleted = [message_id for message_id, fields in entries if not fields]
+        if deleted:
+            self.connection.xack(self.stream, self.group, *deleted)
+        return [self.to_message(message_id, fields) for message_id, fields in entries if fields]
+
+    def touch(self, messages):
+        """
+        Reset the idle time of the pending ``messages``, which are still running, so that no
+        other consumer claims them.
+        """
+        message_ids = [message.message_id for message in messages]
+        if message_ids:
+            self.connection.xclaim(self.stream, self.group, self.consumer, 0, message_ids, justid=True)
+
+    def ack(self, message):
+        pipe = self.connection.pipeline()
+        pipe.xack(self.stream, self.group, message.message_id)
+        pipe.xdel(self.stream, message.message_id)
+        pipe.execute()
+
+    def fail(self, message, error):
+        self.connection.xadd(self.failed_stream, {
+            'task': message.name,
+            'payload': json.dumps({'args': message.args, 'kwargs': message.kwargs}),
+            'attempt': message.attempt,
+            'error': error,
+        }, maxlen=self.max_failed, approximate=True)
+        self.ack(message)
+
+    def __len__(self):
+        return self.connection.xlen(self.stream)
+
+
+class LocalBackend(object):
+    """
+    Tasks kept in memory of the current process, standing in for Redis in tests.
+    """
+    def __init__(self):
+        self.queue = deque()
+        self.pending = OrderedDict()
+        self.failed = []
+        self._counter = 0
+
+    def push(self, name, args, kwargs, attempt=0):
+        self._counter += 1
+        message_id = '{}-0'.format(self._counter)
+        # serialize the arguments, to detect those which would not survive the trip through Redis
+        self.queue.append((message_id, json.dumps({'args': args, 'kwargs': kwargs}), name, attempt))
+        return message_id
+
+    def fetch(self, count, timeout=None):
+        messages = []
+        while self.queue and len(messages) < count:
+            message_id, payload, name, attempt = self.queue.popleft()
+            payload = json.loads(payload)
+            messages.append(Message(message_id, name, payload['args'], payload['kwargs'], attempt))
+            self.pending[message_id] = messages[-1]
+        return messages
+
+    def touch(self, messages):
+        pass
+
+    def ack(self, message):
+        self.pending.pop(message.message_id, None)
+
+    def fail(self, message, error):
+        self.failed.append((message, error))
+        self.ack(message)
+
+    def __len__(self):
+        return len(self.queue)
+
+
+class TaskQueue(object):
+    """
+    Queue tasks into ``backend`` and retry them, if they fail. Without backend, tasks are run
+    synchronously.
+    """
+    max_retries = 3
+    touch_interval = 60  # seconds between renewing the claims of running tasks
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    def enqueue(self, name, *args, **kwargs):
+        """
+        Queue the task ``name``, once the current transaction has been committed, so that the
+        task finds the objects created in it.
+        """
+        if self.backend is None:
+            transaction.on_commit(lambda: get_task(name)(*args, **kwargs))
+        else:
+            transaction.on_commit(lambda: self.backend.push(name, list(args), kwargs))
+
+    def done(self, message):
+        self.backend.ack(message)
+
+    def retry(self, message, error):
+        """
+        Queue a failed task again, or give up after ``max_retries`` attempts.
+        """
+        logger.warning("Task {} failed: {}".format(message, error))
+        if message.attempt < self.max_retries:
+            self.backend.push(message.name, message.args, message.kwargs, attempt=message.attempt + 1)
+            self.backend.ack(message)
+        else:
+            logger.error("Giving up task {}".format(message))
+            self.backend.fail(message, error)
+
+    def run_pending(self):
+        """
+        Run all queued tasks in this process. Return the number of tasks run.
+        """
+        processed = 0
+        while True:
+            messages = self.backend.fetch(100, timeout=0)
+            if not messages:
+                return processed
+            for message in messages:
+                try:
+                    get_task(message.name)(*message.args, **message.kwargs)
+                except Exception as exc:
+                    self.retry(message, repr(exc))
+                else:
+                    self.done(message)
+                processed += 1
+
+    def process(self, executor, max_running):
+        """
+        Run the queued tasks in the process pool ``executor``, at most ``max_running`` at a time.
+        Never returns, hence is run in a thread of the worker.
+        """
+        slots = threading.BoundedSemaphore(max_running)
+        running = {}
+        running_lock = threading.Lock()
+        touched = time.monotonic()
+
+        def finished(future, message):
+            with running_lock:
+                running.pop(message.message_id, None)
+            try:
+                future.result()
+            except Exception as exc:
+                self.retry(message, repr(exc))
+            else:
+                self.done(message)
+            finally:
+                slots.release()
+
+        def touch():
+            # tasks running longer than the backend's claim time must not be run twice
+            nonlocal touched
+            if time.monotonic() - touched < self.touch_interval:
+                return
+            touched = time.monotonic()
+            with running_lock:
+                messages = list(running.values())
+            try:
+                self.backend.touch(messages)
+            except Exception:
+                logger.exception("Failed to renew the claims of running tasks")
+
+        while True:
+            while not slots.acquire(timeout=5):
+                touch()
+            touch()
+            count = 1
+            while count < max_running and slots.acquire(blocking=False):
+                count += 1
+            try:
+                messages = self.backend.fetch(count, timeout=5)
+            except Exception:
+                logger.exception("Failed to fetch tasks")
+                messages = []
+                time.sleep(5)
+            for _ in range(count - len(messages)):
+                slots.release()
+            for message in messages:
+                with running_lock:
+                    running[message.message_id] = message
+                future = executor.submit(execute_task, message.name, message.args, message.kwargs)
+                future.add_done_callback(functools.partial(finished, message=message))
+
+
+_task_queue = None
+
+
+def get_task_queue():
+    """
+    Return the task queue, using the backend named in ``settings.ALBY_TASK_QUEUE_BACKEND``,
+    otherwise Redis if available.
+    """
+    global _task_queue
+
+    if _task_queue is None:
+        backend_class = getattr(settings, 'ALBY_TASK_QUEUE_BACKEND', None)
+        if backend_class:
+            backend = import_string(backend_class)()
+        else:
+            connection = get_redis_connection()
+            backend = None if connection is None else RedisStreamBackend(connection)
+        _task_queue = TaskQueue(backend)
+    return _task_queue
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tasks queued by request handlers and run by the worker, see ``alby.system.tasks``.
+"""
+from __future__ import unicode_literals
+
+import logging
+from django.core.cache import cache
+from shop.models.order import OrderModel
+from alby.models import SofaModel, SofaVariant
+from alby.system.tasks import task
+
+logger = logging.getLogger('alby')
+
+
+@task
+def notify_order(order_pk, status):
+    """
+    Render and queue the notifications configured for the order's ``status``, the status it
+    had when the task was queued. If the order has left that status meanwhile, its notifications
+    are outdated and skipped, those of the new status are sent by its own transition.
+    """
+    from shop.transition import transition_change_notification
+
+    order = OrderModel.objects.get(pk=order_pk)
+    if order.status != status:
+        logger.info("Skipped notifying order {} of status '{}', it is '{}' now".format(
+            order_pk, status, order.status))
+        return
+    transition_change_notification(order)
+
+
+@task
+def update_variant_gallery(variant_pk):
+    """
+    Generate the thumbnails of the variant's images and rebuild its cached gallery.
+    """
+    if not SofaVariant.objects.filter(pk=variant_pk).exists():
+        # the images have been deleted along with their variant
+        cache.delete(SofaVariant.get_gallery_cache_key(variant_pk))
+        return
+    SofaVariant.update_gallery(variant_pk)
+    SofaModel.invalidate_variant_matrix(
+        SofaVariant.objects.filter(pk=variant_pk).values_list('product_model_id', flat=True))
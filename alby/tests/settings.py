@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Settings for running the tests: an in-memory database, no Redis and the SQLite search backend
+writing into a temporary directory.
+"""
+from __future__ import unicode_literals
+
+import os
+import tempfile
+
+os.environ.pop('REDIS_HOST', None)
+os.environ['SEARCH_BACKEND'] = 'sqlite'
+os.environ.setdefault('DJANGO_WORKDIR', tempfile.mkdtemp(prefix='alby-tests-'))
+
+from alby.settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    },
+}
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.BaseSignalProcessor'
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.core.management import call_command
+from post_office.models import Email, Log, PRIORITY, STATUS
+
+
+@pytest.fixture
+def post_office_settings(settings):
+    settings.POST_OFFICE = {
+        'BACKENDS': {'default': 'django.core.mail.backends.locmem.EmailBackend'},
+        'LOG_LEVEL': 2,
+    }
+    return settings
+
+
+def queue_mail(subject, priority, **kwargs):
+    return Email.objects.create(from_email='shop@example.com', to=['customer@example.com'],
+                                subject=subject, message=subject, status=STATUS.queued,
+                                priority=priority, **kwargs)
+
+
+@pytest.mark.django_db
+def test_higher_priority_sent_first(post_office_settings, mailoutbox):
+    queue_mail("low", PRIORITY.low)
+    queue_mail("medium", PRIORITY.medium)
+    queue_mail("high", PRIORITY.high)
+    queue_mail("medium again", PRIORITY.medium)
+    call_command('dispatch_queued_mail', connections=1)
+    assert [message.subject for message in mailoutbox] == ["high", "medium", "medium again", "low"]
+
+
+@pytest.mark.django_db
+def test_status_and_log_recorded(post_office_settings, mailoutbox):
+    sent = queue_mail("sent", PRIORITY.medium)
+    # an unknown backend alias makes preparing the message fail
+    failed = queue_mail("failed", PRIORITY.medium, backend_alias='unknown')
+    call_command('dispatch_queued_mail')
+
+    assert [message.subject for message in mailoutbox] == ["sent"]
+    sent.refresh_from_db()
+    failed.refresh_from_db()
+    assert (sent.status, failed.status) == (STATUS.sent, STATUS.failed)
+    assert list(sent.logs.values_list('status', flat=True)) == [STATUS.sent]
+    log, = failed.logs.all()
+    assert (log.status, log.exception_type) == (STATUS.failed, 'KeyError')
+    assert Log.objects.count() == 2
+
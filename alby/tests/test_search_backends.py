@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import time
+import pytest
+from django.contrib.sites.models import Site
+from haystack import connections, indexes
+from haystack.backends import BaseEngine, BaseSearchBackend
+from haystack.query import SearchQuerySet
+from alby.search_backends import SQLiteSearchQuery
+
+
+class SiteIndex(indexes.SearchIndex, indexes.Indexable):
+    text = indexes.CharField(document=True)
+    name = indexes.CharField(model_attr='name')
+    domain = indexes.CharField(model_attr='domain', indexed=False)
+    autocomplete = indexes.EdgeNgramField(model_attr='name')
+    rank = indexes.IntegerField(model_attr='pk')
+
+    def get_model(self):
+        return Site
+
+    def prepare_text(self, obj):
+        return '{} {}'.format(obj.name, obj.domain)
+
+
+class UnavailableSearchBackend(BaseSearchBackend):
+    """
+    Stands in for an Elasticsearch node which cannot be reached.
+    """
+    def fail(self, *args, **kwargs):
+        raise ConnectionError("Connection refused")
+
+    update = remove = clear = search = fail
+
+
+class UnavailableSearchEngine(BaseEngine):
+    backend = UnavailableSearchBackend
+    query = SQLiteSearchQuery
+
+
+SITES = [
+    Site(pk=1, name="Velvet sofa", domain='velvet.example.com'),
+    Site(pk=2, name="Leather sofa", domain='leather.example.com'),
+    Site(pk=3, name="Oak table", domain='oak.example.com'),
+]
+
+
+@pytest.fixture
+def connection():
+    """
+    Yield a function adding a search connection with the given options, which is removed again
+    after the test.
+    """
+    aliases = []
+
+    def add_connection(alias, **options):
+        connections.connections_info[alias] = options
+        aliases.append(alias)
+        connections.reload(alias).get_unified_index().build(indexes=[SiteIndex()])
+        return connections[alias]
+
+    yield add_connection
+    for alias in aliases:
+        del connections.connections_info[alias]
+        connections.thread_local.connections.pop(alias, None)
+
+
+@pytest.fixture
+def sqlite(connection, tmpdir):
+    engine = connection('sqlite-test', ENGINE='alby.search_backends.SQLiteSearchEngine',
+                        PATH=str(tmpdir.join('index.sqlite3')))
+    engine.get_backend().update(SiteIndex(), SITES)
+    return engine
+
+
+def search(alias):
+    return SearchQuerySet(using=alias).models(Site)
+
+
+def pks(results):
+    return sorted(int(result.pk) for result in results)
+
+
+def test_content_search(sqlite):
+    assert pks(search('sqlite-test').filter(content='sofa')) == [1, 2]
+    assert pks(search('sqlite-test').filter(content='velvet sofa')) == [1]
+    # the domain is part of the document, but no term of its own
+    assert pks(search('sqlite-test').filter(content='oak.example.com')) == [3]
+    assert pks(search('sqlite-test').filter(content='chair')) == []
+
+
+def test_term_filters(sqlite):
+    assert pks(search('sqlite-test').filter(name__exact="Oak table")) == [3]
+    assert pks(search('sqlite-test').filter(name__in=["Oak table", "Leather sofa"])) == [2, 3]
+    assert pks(search('sqlite-test').filter(name__startswith="Velvet")) == [1]
+    assert pks(search('sqlite-test').filter(rank__gte=2)) == [2, 3]
+    assert pks(search('sqlite-test').filter(rank__range=[1, 2])) == [1, 2]
+    assert pks(search('sqlite-test').exclude(rank=2)) == [1, 3]
+    assert pks(search('sqlite-test').filter(content='sofa', rank__lt=2)) == [1]
+
+
+def test_query_fragments(sqlite):
+    query = SQLiteSearchQuery(using='sqlite-test')
+    assert query.build_query_fragment('name', 'exact', "it's") == (
+        "id IN (SELECT id FROM terms WHERE field = 'name' AND value = 'it''s')")
+    assert query.build_query_fragment('name', 'contains', "50%") == (
+        "id IN (SELECT id FROM terms WHERE field = 'name' AND value LIKE '%50\\%%' ESCAPE '\\')")
+    assert query.build_query_fragment('content', 'content', "velvet, sofa") == (
+        "id IN (SELECT id FROM fulltext WHERE fulltext MATCH 'content : \"velvet\" AND content : \"sofa\"')")
+    assert query.build_query_fragment('autocomplete', 'content', "sof") == (
+        "id IN (SELECT id FROM fulltext WHERE fulltext MATCH 'prefix : \"sof\"*')")
+    assert query.build_query_fragment('content', 'content', "?!") == '1'
+
+
+def test_prefix_search(sqlite):
+    assert pks(search('sqlite-test').autocomplete(autocomplete='sof')) == [1, 2]
+    assert pks(search('sqlite-test').autocomplete(autocomplete='lea so')) == [2]
+    # prefixes only match the autocomplete field
+    assert pks(search('sqlite-test').filter(content='sof')) == []
+
+
+def test_order_and_stored_fields(sqlite):
+    results = search('sqlite-test').filter(content='sofa').order_by('-rank')
+    assert [result.name for result in results] == ["Leather sofa", "Velvet sofa"]
+    assert results.count() == 2
+
+
+def test_remove_and_clear(sqlite):
+    backend = sqlite.get_backend()
+    backend.remove(SITES[0])
+    assert pks(search('sqlite-test').filter(content='sofa')) == [2]
+    backend.clear()
+    assert pks(search('sqlite-test').filter(content='sofa')) == []
+
+
+def test_replacement(sqlite):
+    backend = sqlite.get_backend()
+    replacement = backend.create_replacement()
+    replacement.update(SiteIndex(), SITES[2:])
+    # searches keep using the current index until the replacement is complete
+    assert pks(search('sqlite-test').filter(content='example')) == [1, 2, 3]
+    backend.replace_with(replacement)
+    assert os.path.realpath(backend.path) == replacement.path
+    assert pks(search('sqlite-test').filter(content='example')) == [3]
+
+    # the replaced index can be replaced in turn, which deletes the previous file
+    previous = replacement.path
+    replacement = backend.create_replacement()
+    replacement.update(SiteIndex(), SITES[:1])
+    backend.replace_with(replacement)
+    assert os.path.realpath(backend.path) == replacement.path
+    assert not os.path.exists(previous)
+    assert pks(search('sqlite-test').filter(content='example')) == [1]
+
+
+def test_fallback_while_primary_unavailable(connection, tmpdir):
+    engine = connection('fallback-test', ENGINE='alby.search_backends.FallbackSearchEngine',
+                        RETRY_AFTER=60,
+                        PRIMARY={'ENGINE': 'alby.tests.test_search_backends.UnavailableSearchEngine'},
+                        FALLBACK={'ENGINE': 'alby.search_backends.SQLiteSearchEngine',
+                                  'PATH': str(tmpdir.join('fallback.sqlite3'))})
+    backend = engine.get_backend()
+    assert backend.is_primary_available()
+
+    # writing does not fail, the documents end up in the fallback index
+    backend.update(SiteIndex(), SITES)
+    assert not backend.is_primary_available()
+    assert backend.unavailable_until > time.time() + 50
+    assert pks(search('fallback-test').filter(content='sofa')) == [1, 2]
+
+    # searching switches over to the fallback index as well
+    backend.unavailable_until = 0
+    assert pks(search('fallback-test').filter(content='table')) == [3]
+    assert not backend.is_primary_available()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.db import transaction
+from alby.system.tasks import LocalBackend, TaskQueue, get_task, task
+
+calls = []
+
+
+@task
+def record(value, suffix=''):
+    calls.append(value + suffix)
+
+
+@task
+def explode(value):
+    calls.append(value)
+    raise RuntimeError(value)
+
+
+@pytest.fixture
+def queue():
+    del calls[:]
+    return TaskQueue(LocalBackend())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_enqueue_after_commit(queue):
+    with transaction.atomic():
+        queue.enqueue(record.task_name, 'a', suffix='!')
+        assert len(queue.backend) == 0
+    assert len(queue.backend) == 1
+    message, = queue.backend.fetch(10)
+    assert (message.name, message.args, message.kwargs, message.attempt) == (
+        'alby.tests.test_tasks.record', ['a'], {'suffix': '!'}, 0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_enqueue_dropped_on_rollback(queue):
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            queue.enqueue(record.task_name, 'a')
+            raise ValueError
+    assert len(queue.backend) == 0
+
+
+def test_fetched_tasks_pending_until_acknowledged(queue):
+    queue.backend.push(record.task_name, ['a'], {})
+    queue.backend.push(record.task_name, ['b'], {})
+    first, = queue.backend.fetch(1)
+    assert list(queue.backend.pending) == [first.message_id]
+    queue.done(first)
+    assert not queue.backend.pending
+    assert len(queue.backend) == 1
+
+
+def test_run_pending_acknowledges(queue):
+    queue.backend.push(record.task_name, ['a'], {})
+    queue.backend.push(record.task_name, ['b'], {'suffix': '!'})
+    assert queue.run_pending() == 2
+    assert calls == ['a', 'b!']
+    assert not queue.backend.pending
+    assert not queue.backend.failed
+
+
+def test_retry_requeues_next_attempt(queue):
+    queue.backend.push(explode.task_name, ['a'], {})
+    message, = queue.backend.fetch(1)
+    queue.retry(message, 'boom')
+    assert not queue.backend.pending
+    retried, = queue.backend.fetch(1)
+    assert retried.message_id != message.message_id
+    assert (retried.name, retried.args, retried.attempt) == (explode.task_name, ['a'], 1)
+
+
+def test_failed_after_max_retries(queue):
+    queue.backend.push(explode.task_name, ['a'], {})
+    queue.backend.push(record.task_name, ['b'], {})
+    assert queue.run_pending() == 2 + queue.max_retries
+    assert calls == ['a', 'b'] + ['a'] * queue.max_retries
+    (message, error), = queue.backend.failed
+    assert (message.name, message.attempt) == (explode.task_name, queue.max_retries)
+    assert error == repr(RuntimeError('a'))
+    assert not queue.backend.pending
+    assert len(queue.backend) == 0
+
+
+def test_get_task_rejects_other_functions():
+    assert get_task('alby.tests.test_tasks.record') is record
+    with pytest.raises(ValueError):
+        get_task('alby.tests.test_tasks.queue')
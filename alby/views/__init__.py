@@ -1 +1 @@
-from .view import FacebookLogin, UpdateDataView
+from .view import FacebookLogin, FabricDetailsView, PriceCurveView, VariantMatrixView
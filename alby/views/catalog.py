@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import json
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.cache import add_never_cache_headers
+from django.utils.translation import get_language_from_request
+from shop.search.views import CMSPageCatalogWrapper
+from shop.views.catalog import ProductRetrieveView as BaseProductRetrieveView
+from alby.autocomplete import AutocompleteFilterBackend, get_prefix_index
+from alby.models import SofaModel, SofaVariant
+from alby.system.cache import get_catalog_version
+
+
+class AutocompleteCatalogWrapper(CMSPageCatalogWrapper):
+    """
+    Answer the autocomplete lookups of the catalog from the prefix index written by the worker.
+    The search engine is only asked while that index is unavailable.
+    """
+    filter_backends = CMSPageCatalogWrapper.filter_backends + [AutocompleteFilterBackend]
+
+    def __call__(self, request):
+        if request.GET.get('q') and get_prefix_index().is_available():
+            return self.list_view(request)
+        return super(AutocompleteCatalogWrapper, self).__call__(request)
+
+
+class ProductRetrieveView(BaseProductRetrieveView):
+    """
+    Detail view of a product, fetching the variants of a sofa together with their fabrics,
+    since the template iterates over them repeatedly.
+    """
+    def get_object(self):
+        if not hasattr(self, '_product'):
+            product = super(ProductRetrieveView, self).get_object()
+            if isinstance(product, SofaModel):
+                variants = SofaVariant.objects.select_related('product_code', 'fabric__product_code')
+                prefetch_related_objects([product], Prefetch('variants', queryset=variants))
+        return self._product
+
+
+def get_catalog_cache_key(request):
+    """
+    Build the cache key from the page, the language, the normalized search query, the filters,
+    the pagination and the catalog version, so that saving a product outdates all entries.
+    """
+    params = request.GET.copy()
+    query = ' '.join(params.pop('q', [''])[-1].lower().split())
+    filters = sorted((key, value) for key in params for value in params.getlist(key) if value)
+    key = json.dumps([request.path, get_language_from_request(request), query, filters])
+    return 'alby:catalog-response:{}:{}'.format(get_catalog_version(), hashlib.md5(key.encode('utf-8')).hexdigest())
+
+
+def cache_catalog_response(view):
+    """
+    Decorate a catalog or search view to keep its JSON responses in the cache for
+    ``settings.ALBY_CATALOG_CACHE_TTL`` seconds. Pages rendered as HTML are never cached.
+    Browsers must not cache the JSON responses themselves, since they are not invalidated.
+
+    The catalog version is bumped when a product is saved, and again once the search index has
+    been updated, so responses cached while the index still was outdated are dropped as well.
+    """
+    @wraps(view)
+    def wrapped_view(request, *args, **kwargs):
+        if request.method != 'GET' or 'application/json' not in request.META.get('HTTP_ACCEPT', ''):
+            return view(request, *args, **kwargs)
+        cache_key = get_catalog_cache_key(request)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            response = HttpResponse(cached[1], content_type=cached[0])
+            add_never_cache_headers(response)
+            return response
+
+        def store(response):
+            if response.status_code == 200 and response['Content-Type'].startswith('application/json'):
+                ttl = getattr(settings, 'ALBY_CATALOG_CACHE_TTL', 60)
+                cache.set(cache_key, (response['Content-Type'], response.content), ttl)
+
+        response = view(request, *args, **kwargs)
+        add_never_cache_headers(response)
+        if hasattr(response, 'add_post_render_callback'):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+        return response
+
+    return wrapped_view
@@ -1,10 +1,12 @@
+import hashlib
 from allauth.socialaccount.providers.facebook.views import FacebookOAuth2Adapter
 from rest_auth.registration.views import SocialLoginView
-from rest_framework.generics import RetrieveAPIView
-from alby.models import ProductList
+from rest_framework.views import APIView
+from alby.models import Fabric, Product, SofaModel
 from rest_framework.response import Response
-from rest_framework.status import HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST
+from rest_framework.status import HTTP_304_NOT_MODIFIED, HTTP_400_BAD_REQUEST
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 
 
 
@@ -12,21 +14,75 @@ class FacebookLogin(SocialLoginView):
     adapter_class = FacebookOAuth2Adapter
 
 
-class UpdateDataView(RetrieveAPIView):
-    product_model = ProductList
+class FabricDetailsView(APIView):
+    """
+    Return name, type, composition, care and description of the fabrics given by one or many
+    ``product_code`` query parameters, mapped by their product code.
+    """
+    product_model = Fabric
+    max_age = 300
+    max_codes = 100
 
-    def get_context(self, request, **kwargs):
-        code = self.request.data.get('product_code')
-        product = self.product_model.objects.get(product_code=code)
-        product = product.fabric_set.get(product_code=product.id)
-        # product = get_object_or_404(queryset)
-        # product = product.product_code
-        return {'product': product, 'request': request}
+    def get(self, request, slug=None):
+        product_codes = []
+        for value in request.query_params.getlist('product_code'):
+            product_codes.extend(code for code in value.split(',') if code and code not in product_codes)
+        if not product_codes or len(product_codes) > self.max_codes:
+            return Response({'product_code': "Expected between 1 and {} product codes".format(self.max_codes)},
+                            status=HTTP_400_BAD_REQUEST)
+        response = Response(self.product_model.get_details(product_codes))
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
 
-    def post(self, request, *args, **kwargs):
-        context = self.get_context(request, **kwargs)
-        serializer = self.serializer_class(data=request.data, context=context)
-        if serializer.is_valid():
-            return Response(serializer.data, status=HTTP_202_ACCEPTED)
-        return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
 
+class VariantMatrixView(APIView):
+    """
+    Return all variants of a sofa model as one JSON document, tagged with an ETag, so that the
+    detail page can switch between fabrics without further requests.
+    """
+    product_model = SofaModel
+    max_age = 300
+
+    def get(self, request, slug=None):
+        product = get_object_or_404(self.product_model.objects.filter(active=True), slug=slug)
+        matrix = product.get_variant_matrix()
+        etag = '"{}"'.format(matrix['etag'])
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = Response(status=HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({'product': matrix['product'], 'variants': matrix['variants']})
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
+
+
+class PriceCurveView(APIView):
+    """
+    Return the unit price per quantity tier of a product with quantity rebates, so that the
+    product page can price any quantity locally while the customer types.
+    """
+    product_model = Product
+    max_age = 300
+
+    def get(self, request, slug=None):
+        product = get_object_or_404(self.product_model.objects.filter(active=True), slug=slug)
+        get_price_curve = getattr(product, 'get_price_curve', None)
+        if get_price_curve:
+            curve = get_price_curve(request)
+        else:
+            unit_price = product.get_price(request)
+            unit_price = str(unit_price.as_decimal())
+            curve = {
+                'product': product.pk,
+                'version': hashlib.md5(unit_price.encode('utf-8')).hexdigest(),
+                'unit_price': unit_price,
+                'tiers': [{'quantity': 1, 'rebate': 0, 'unit_price': unit_price}],
+            }
+        etag = '"{}"'.format(curve['version'])
+        if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+            response = Response(status=HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(curve)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=self.max_age)
+        return response
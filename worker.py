@@ -1,39 +1,148 @@
 #!/usr/bin/env python
+import asyncio
+import datetime
+import logging
 import os
-import redis
-import schedule
+import threading
 import time
+import schedule
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management import call_command
+
+logger = logging.getLogger('alby')
+
+# channel onto which django-SHOP publishes, see ``shop.signals.email_queued``
+CHANNEL = 'django-SHOP'
+
+
+def run_command(name, *args, slot=None, **options):
+    """
+    Run a management command, unless another worker replica is running it already or has run
+    its ``slot``. Errors are logged, since raising them would end the worker.
+    """
+    from alby.system.locks import run_exclusively
+
+    try:
+        return run_exclusively(name, slot, call_command, name, *args, **options)
+    except Exception:
+        logger.exception("Command '{}' failed".format(name))
+
+
+def schedule_command(job, name, *args, **options):
+    """
+    Schedule a management command to run once per period of ``job`` across all replicas. Each
+    run is identified by the period it has been scheduled in, replicas running jobs at a given
+    time, using ``at()``, hence agree on it even if their clocks drift slightly.
+    """
+    period = datetime.timedelta(**{job.unit: job.interval}).total_seconds()
+
+    def run():
+        slot = int(job.next_run.timestamp() // period)
+        return run_command(name, *args, slot=slot, **options)
+
+    return job.do(run)
+
+
+def run_local_command(name, *args, **options):
+    """
+    Run a management command whose work concerns only this node, logging its errors.
+    """
+    try:
+        return call_command(name, *args, **options)
+    except Exception:
+        logger.exception("Command '{}' failed".format(name))
+
+
+# handlers for the messages published on CHANNEL
+MESSAGE_HANDLERS = {
+    'send_queued_mail': lambda: run_command('dispatch_queued_mail'),
+}
+
+
+def listen(connection, loop, queue):
+    """
+    Forward the messages published on CHANNEL into the asyncio queue. Runs in its own thread,
+    blocking on the Redis connection, and reconnects if the connection is lost.
+    """
+    import redis
+
+    while True:
+        try:
+            pubsub = connection.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            for message in pubsub.listen():
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                loop.call_soon_threadsafe(queue.put_nowait, data)
+        except redis.ConnectionError as exc:
+            logger.warning("Lost subscription to '{}', reconnecting: {}".format(CHANNEL, exc))
+            time.sleep(5)
+
+
+def dispatch(message):
+    try:
+        handler = MESSAGE_HANDLERS[message]
+    except KeyError:
+        logger.warning("No handler for message '{}' on '{}'".format(message, CHANNEL))
+    else:
+        try:
+            handler()
+        except Exception:
+            logger.exception("Handling message '{}' failed".format(message))
+
+
+async def run(queue):
+    """
+    Sleep until either a message arrives or the next scheduled job is due.
+    """
+    while True:
+        timeout = schedule.idle_seconds()
+        try:
+            message = await asyncio.wait_for(queue.get(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            schedule.run_pending()
+        else:
+            dispatch(message)
 
 
 if __name__ == '__main__':
     from django import setup
-    from django.conf import settings
-    from django.core.management import call_command
-    from django.utils import timezone
 
     # initialize Django
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alby.settings')
     setup()
 
+    from django.db import connections
+    from alby.system.redis import get_blocking_redis_connection, get_redis_connection
+    from alby.system.tasks import RedisStreamBackend, TaskQueue
+
+    r = get_redis_connection()
+    if r is not None:
+        # start the processes running the queued tasks, before this process opens database
+        # connections they would inherit
+        connections.close_all()
+        workers = int(os.environ.get('WORKER_PROCESSES', os.cpu_count()))
+        executor = ProcessPoolExecutor(max_workers=workers)
+        executor.submit(int).result()
+
     # schedule jobs
-    schedule.every().minute.do(call_command, 'send_queued_mail')
-    rebuild_at = timezone.now() + timezone.timedelta(minutes=6)
-    schedule.every().hour.at(rebuild_at.strftime(':%M')).do(call_command, 'rebuild_index', interactive=False)
-    schedule.every().sunday.do(call_command, 'shopcustomers', delete_expired=True)
-
-    if hasattr(settings, 'SESSION_REDIS'):
-        redis_con = dict((key, settings.SESSION_REDIS[key]) for key in ['host', 'port', 'db', 'socket_timeout'])
-        pool = redis.ConnectionPool(**redis_con)
-        r = redis.Redis(connection_pool=pool)
-        pubsub = r.pubsub()
-        pubsub.subscribe('django-SHOP')
-    else:
-        pubsub = type(str('PubSub'), (), {'get_message': lambda s: None})()
+    # when running several replicas of the worker, each run of a job happens on only one of them
+    schedule_command(schedule.every().minute, 'dispatch_queued_mail')
+    # the search index is kept up to date by draining the queue of changed products, the nightly
+    # rebuild only sweeps up inconsistencies
+    schedule_command(schedule.every().day.at('03:06'), 'rebuild_search_index')
+    schedule_command(schedule.every().sunday.at('04:12'), 'shopcustomers', delete_expired=True)
+    # the autocomplete index is a file on the local disk, hence built by every replica
+    run_local_command('build_autocomplete_index')
+    schedule.every(5).minutes.do(run_local_command, 'build_autocomplete_index')
 
-    while True:
-        message = pubsub.get_message()
-        if message:
-            if message['data'] == 'send_queued_mail':
-                call_command('send_queued_mail')
-        schedule.run_pending()
-        time.sleep(1)
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    if r is not None:
+        schedule_command(schedule.every(10).seconds, 'update_search_queue')
+        threading.Thread(target=listen, args=(get_blocking_redis_connection(), loop, queue), daemon=True).start()
+        task_queue = TaskQueue(RedisStreamBackend(get_blocking_redis_connection()))
+        threading.Thread(target=task_queue.process, args=(executor, workers), daemon=True).start()
+
+    loop.run_until_complete(run(queue))